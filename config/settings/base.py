@@ -299,3 +299,35 @@ STATICFILES_FINDERS += ["compressor.finders.CompressorFinder"]
 # Your stuff...
 # ------------------------------------------------------------------------------
 ST_STORES_DATA_DIR = env("ST_STORES_DATA_DIR", default=ROOT_DIR('data'))
+# timeout (in seconds) of connecting to data source and of every read from it
+ST_FETCH_TIMEOUT = env.int("ST_FETCH_TIMEOUT", default=60)
+# max number of data sources fetched at the same time, in total and from the same host
+ST_FETCH_CONCURRENCY = env.int("ST_FETCH_CONCURRENCY", default=8)
+ST_FETCH_PER_HOST_CONCURRENCY = env.int("ST_FETCH_PER_HOST_CONCURRENCY", default=2)
+# changes of at least this number of offers are applied with COPY and set-based statements
+ST_BULK_APPLY_MIN_OFFERS = env.int("ST_BULK_APPLY_MIN_OFFERS", default=1000)
+# offers extracted from revisions are kept up to this size (in bytes) in total, 0 disables it
+ST_SNAPSHOTS_MAX_SIZE = env.int("ST_SNAPSHOTS_MAX_SIZE", default=1024 * 1024 * 1024)
+# number of processes, in which offers of big feeds are extracted at the same time, 1 disables it
+ST_EXTRACT_PROCESSES = env.int("ST_EXTRACT_PROCESSES", default=1)
+# feeds of at least this size (in bytes, as stored) are extracted in ST_EXTRACT_PROCESSES processes
+ST_SHARDED_EXTRACT_MIN_SIZE = env.int("ST_SHARDED_EXTRACT_MIN_SIZE", default=64 * 1024 * 1024)
+# fetched data is parsed while it is downloaded, invalid XML is rejected before it is saved
+ST_FETCH_PARSE_WHILE_DOWNLOADING = env.bool("ST_FETCH_PARSE_WHILE_DOWNLOADING", default=True)
+# storage of fetched revisions of data: "git" (repository per store) or "zstd" (compressed blobs)
+ST_STORAGE_BACKEND = env("ST_STORAGE_BACKEND", default="git")
+# bucket of S3-compatible object storage used by "s3" storage backend, credentials are read by boto3
+ST_S3_BUCKET = env("ST_S3_BUCKET", default="")
+ST_S3_ENDPOINT_URL = env("ST_S3_ENDPOINT_URL", default="")
+ST_S3_REGION_NAME = env("ST_S3_REGION_NAME", default="us-east-1")
+ST_S3_PREFIX = env("ST_S3_PREFIX", default="revisions/")
+# revisions are uploaded in parts (at least 5 MiB) and read in ranges of these sizes (in bytes)
+ST_S3_PART_SIZE = env.int("ST_S3_PART_SIZE", default=64 * 1024 * 1024)
+ST_S3_READ_CHUNK_SIZE = env.int("ST_S3_READ_CHUNK_SIZE", default=8 * 1024 * 1024)
+# revisions read from remote storage are cached on local disk up to this size (in bytes) in total, 0 disables it
+ST_REVISION_CACHE_MAX_SIZE = env.int("ST_REVISION_CACHE_MAX_SIZE", default=4 * 1024 * 1024 * 1024)
+# fetch and update of store are locked with "file" (processes of one node) or "redis" (all nodes) locks,
+# lease (in seconds) of redis lock is renewed while it is held
+ST_STORE_LOCK_BACKEND = env("ST_STORE_LOCK_BACKEND", default="file")
+ST_STORE_LOCK_REDIS_URL = env("REDIS_URL", default="redis://localhost:6379/0")
+ST_STORE_LOCK_LEASE = env.int("ST_STORE_LOCK_LEASE", default=60)
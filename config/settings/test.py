@@ -49,3 +49,5 @@ EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
 
 # Your stuff...
 # ------------------------------------------------------------------------------
+# snapshots of extracted offers would be shared between tests
+ST_SNAPSHOTS_MAX_SIZE = 0
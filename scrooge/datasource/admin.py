@@ -18,7 +18,7 @@ def dict_of_required_fields():
                 'name': DataSourceFieldName.objects.get(name=field.name).id
             }
             for field in Offer._meta.fields
-            if field.name not in ['id', 'store', 'data']
+            if field.name not in ['id', 'store', 'data'] and field.editable  # not editable fields are not extracted
         ]
     except ProgrammingError as e:
         logger.warning('Some migrations are not applied!')
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def diff_fingerprints(old_ids, old_fingerprints, new_ids, new_fingerprints, old_outdated=None):
+    """
+    Classifies offers of two revisions, which are reduced to arrays of external ids
+    and fingerprints, so offers are compared with vectorized operations instead of dict by dict.
+
+    :param old_ids: int64 array of external ids of stored offers
+    :param old_fingerprints: int64 array of fingerprints of stored offers
+    :param new_ids: int64 array of external ids of offers from new revision (unique)
+    :param new_fingerprints: int64 array of fingerprints of offers from new revision
+    :param old_outdated: bool array of stored offers, which are modified if they are still present
+                         (e.g. their fingerprints were computed by previous version of data source)
+    :return: dict with indexes of 'added' and 'modified' offers in new arrays
+             and indexes of 'deleted' offers in old arrays
+    """
+    if old_outdated is None:
+        old_outdated = np.zeros(len(old_ids), dtype=bool)
+
+    order = np.argsort(old_ids, kind='stable')
+    sorted_old_ids = old_ids[order]
+
+    positions = np.searchsorted(sorted_old_ids, new_ids)
+    if len(sorted_old_ids):
+        old_indexes = order[np.minimum(positions, len(sorted_old_ids) - 1)]
+        found = old_ids[old_indexes] == new_ids
+    else:
+        old_indexes = np.zeros(len(new_ids), dtype=np.intp)
+        found = np.zeros(len(new_ids), dtype=bool)
+
+    changed = found.copy()
+    changed[found] = (
+        (old_fingerprints[old_indexes[found]] != new_fingerprints[found]) | old_outdated[old_indexes[found]]
+    )
+
+    deleted = ~np.isin(old_ids, new_ids, assume_unique=True)
+
+    return {
+        'added': np.flatnonzero(~found),
+        'deleted': np.flatnonzero(deleted),
+        'modified': np.flatnonzero(changed),
+    }
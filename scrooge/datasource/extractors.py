@@ -0,0 +1,278 @@
+import logging
+import re
+import threading
+from collections import defaultdict
+from decimal import Decimal
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# relative path built only from plain element names, ending with element, attribute or text(), e.g. ./imgs/main/@url
+SIMPLE_XPATH_RE = re.compile(r'^(\./)?([A-Za-z_][\w.-]*/)*([A-Za-z_][\w.-]*|@[A-Za-z_][\w.-]*|text\(\))$')
+
+# compiled extractors shared by extraction runs in the same thread, keyed by version_hash of data source,
+# compiled XPath objects are not thread-safe, so they are not shared by threads of ConcurrentFetcher
+_field_extractors = threading.local()
+
+
+class SimplePath:
+    """
+    Xpath, which selects child elements, their attributes or text by plain names.
+    It is resolved by walking children of node, without XPath engine, and returns
+    the same values in the same order as XPath would.
+    """
+
+    def __init__(self, xpath):
+        steps = (xpath[2:] if xpath.startswith('./') else xpath).split('/')
+        self.elements = [step for step in steps if not step.startswith('@') and step != 'text()']
+        self.attribute = steps[-1][1:] if steps[-1].startswith('@') else None
+        self.text = steps[-1] == 'text()'
+
+    def __call__(self, node, children_by_tag):
+        nodes = [node]
+        if self.elements:
+            nodes = children_by_tag.get(self.elements[0], [])
+            for tag in self.elements[1:]:
+                nodes = [child for parent in nodes for child in parent if child.tag == tag]
+
+        if self.attribute is not None:
+            return [parent.get(self.attribute) for parent in nodes if self.attribute in parent.attrib]
+
+        if self.text:
+            return [
+                text for parent in nodes
+                for text in [parent.text] + [child.tail for child in parent] if text is not None
+            ]
+
+        return nodes
+
+
+class FieldExtractor:
+    """
+    Converts offer node to dict. Names of fields, compiled xpath expressions
+    and value converters are prepared once, so extracting offers does not touch the database.
+    Simple paths are resolved in one pass over children of offer node,
+    only other expressions are evaluated by XPath engine.
+    """
+
+    def __init__(self, fields):
+        """
+        :param fields: list of (field_name, xpath, value_type) tuples, see VALUE_CONVERTERS
+        """
+        self.fields = [
+            (name, self._compile(xpath), VALUE_CONVERTERS[value_type]) for name, xpath, value_type in fields
+        ]
+
+    @staticmethod
+    def _compile(xpath):
+        if not xpath:
+            return None
+
+        return SimplePath(xpath) if SIMPLE_XPATH_RE.match(xpath) else etree.XPath(xpath)
+
+    def __call__(self, node):
+        children_by_tag = defaultdict(list)
+        for child in node:
+            children_by_tag[child.tag].append(child)
+
+        offer_dict = {}
+        for name, xpath, convert in self.fields:
+            if xpath is None:
+                offer_dict[name] = None
+                continue
+
+            values = xpath(node, children_by_tag) if isinstance(xpath, SimplePath) else xpath(node)
+            if not isinstance(values, list):
+                values = [values]  # e.g. number or boolean returned by count() or boolean()
+
+            offer_dict[name] = convert(values)
+
+        return offer_dict
+
+
+def node_to_string(node):
+    """
+    Converts lxml.etree._ElementUnicodeResult (or other xpath result) to str,
+    or whole node to str
+    """
+    return etree.tostring(node, encoding='unicode') if etree.iselement(node) else str(node)
+
+
+def node_to_text(node):
+    """
+    Converts lxml.etree._ElementUnicodeResult (or other xpath result) to str,
+    or node to its text content without markup
+    """
+    return ''.join(node.itertext()) if etree.iselement(node) else str(node)
+
+
+def to_auto(values):
+    if len(values) == 0:
+        return None
+    elif len(values) == 1:
+        return node_to_string(values[0])
+
+    return [node_to_string(value) for value in values]
+
+
+def to_typed(parse):
+    """
+    Returns converter, which parses text of the first value, None if there
+    is no value or it can not be parsed. Numbers returned by xpath functions
+    (e.g. count()) are floats, they are passed to parse as they are.
+    """
+    def convert(values):
+        if not values:
+            return None
+
+        value = values[0]
+        if not isinstance(value, float):
+            value = node_to_text(value).strip()
+            if not value:
+                return None
+
+        try:
+            return parse(value)
+        except (ValueError, ArithmeticError):
+            logger.warning('"{}" can not be converted by {}'.format(value, parse.__name__))
+            return None
+
+    return convert
+
+
+def parse_int(value):
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(value)
+
+    return int(value)
+
+
+def parse_decimal(value):
+    # str gives the shortest representation of float, e.g. 9.99 instead of 9.9900000000000002131628...
+    return Decimal(str(value))
+
+
+def parse_bool(value):
+    if isinstance(value, float):
+        return value != 0
+
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    elif value.lower() in ('0', 'false', 'no'):
+        return False
+
+    raise ValueError(value)
+
+
+# converters of values selected by xpath of field, chosen by value_type of XmlDataField
+VALUE_CONVERTERS = {
+    'auto': to_auto,
+    'str': lambda values: node_to_text(values[0]) if values else None,
+    'markup': lambda values: node_to_string(values[0]) if values else None,
+    'list': lambda values: [node_to_text(value) for value in values],
+    'int': to_typed(parse_int),
+    'decimal': to_typed(parse_decimal),
+    'bool': to_typed(parse_bool),
+}
+
+
+def iter_offer_nodes(source, path):
+    """
+    Streams XML from file-like source and yields elements, which are at given path
+    (list of element names from root). Every element is freed right after it was consumed.
+    """
+    context = etree.iterparse(source, events=('end',), tag=path[-1], huge_tree=True)
+    yield from select_offer_nodes(context, path)
+    del context
+
+
+def select_offer_nodes(events, path):
+    """
+    Yields elements at given path from (event, element) pairs of 'end' events
+    and frees every element right after it was consumed.
+    """
+    for _, node in events:
+        if node_path(node) != path:
+            continue
+
+        yield node
+        free_node(node)
+
+
+def free_node(node):
+    node.clear()
+    parent = node.getparent()
+    if parent is None:
+        return  # root, its siblings are comments or processing instructions of prolog, which can not be removed
+
+    # drop references to already processed siblings, so they can be freed
+    while node.getprevious() is not None:
+        del parent[0]
+
+
+class FeedParser:
+    """
+    Parses XML fed chunk by chunk, e.g. while it is being downloaded. If path
+    (list of element names from root) and extractor are given, offers are
+    extracted as soon as their elements are complete, otherwise document
+    is only checked to be well-formed. Parsed elements are freed on the fly.
+    """
+
+    def __init__(self, path=None, extractor=None):
+        self.path = path
+        self.extractor = extractor
+        self.offers = []
+        self._parser = etree.XMLPullParser(events=('end',), tag=path[-1] if path else None, huge_tree=True)
+
+    def feed(self, data):
+        """
+        :raise etree.XMLSyntaxError: if data is not well-formed
+        """
+        self._parser.feed(data)
+        self._consume()
+
+    def close(self):
+        """
+        :raise etree.XMLSyntaxError: if document is not complete, e.g. download was truncated
+        :return: list of extracted offer dicts, empty if path was not given
+        """
+        self._parser.close()
+        self._consume()
+        return self.offers
+
+    def _consume(self):
+        events = self._parser.read_events()
+        if self.path is None:
+            for _, node in events:
+                free_node(node)
+            return
+
+        for node in select_offer_nodes(events, self.path):
+            self.offers.append(self.extractor(node))
+
+
+def node_path(node):
+    path = []
+    while node is not None:
+        path.append(node.tag)
+        node = node.getparent()
+
+    return path[::-1]
+
+
+def get_field_extractor(data_source):
+    """
+    Returns FieldExtractor for given XmlDataSourceModel. Extractor is compiled
+    only once for every version of data source definition in every thread.
+    """
+    if not hasattr(_field_extractors, 'by_version_hash'):
+        _field_extractors.by_version_hash = {}
+
+    extractor = _field_extractors.by_version_hash.get(data_source.version_hash)
+
+    if extractor is None:
+        fields = data_source.fields.select_related('name')
+        extractor = FieldExtractor([(field.name.name, field.xpath, field.value_type) for field in fields])
+        _field_extractors.by_version_hash[data_source.version_hash] = extractor
+
+    return extractor
@@ -1,17 +1,44 @@
 import logging
+import re
+from io import BytesIO
 from lxml import etree
+import numpy as np
+from urllib.error import HTTPError
 from urllib.request import urlopen, Request
 
+from django.conf import settings
+
+from scrooge.datasource.diff import diff_fingerprints
+from scrooge.datasource.extractors import FeedParser, get_field_extractor, iter_offer_nodes
+from scrooge.datasource.sharding import ShardParseError, extract_sharded
+from scrooge.offers.models import Offer, get_fingerprint
 from scrooge.stores.utils.datastoragemanager import DataStorageManager
+from scrooge.stores.utils.snapshotstorage import SnapshotStorage
 
 logger = logging.getLogger(__name__)
 
+# Absolute xpath built only from plain element names, e.g. /offers/offer
+STREAMABLE_XPATH_RE = re.compile(r'^(/[A-Za-z_][\w.-]*)+$')
+
+
+class ModifiedOffer(dict):
+    """
+    Offer dict, which also knows which of its fields (core fields and keys of
+    additional data) have changed since previous revision, so only these
+    are written to database. changed_fields is None if all fields have to be written.
+    """
+
+    def __init__(self, offer, changed_fields=None):
+        super().__init__(offer)
+        self.changed_fields = changed_fields
+
 
 class DataSourceImpl:
 
     def __init__(self, store):
         self.store = store
         self.ds_manager = DataStorageManager(self.store.name)
+        self.snapshots = SnapshotStorage(self.store.name)
 
     @staticmethod
     def get_all_subclasses():
@@ -49,8 +76,26 @@ class DataSourceImpl:
             offers = self._extract(available_revision)
             self.store.update_offers(revision_number=available_revision, added=offers)
         elif self.store.last_update_revision < available_revision:
+            revision = self.ds_manager.revision(available_revision) if self.store.limits_offer_changes() else None
+            if revision is not None and revision.quarantine_reason:
+                logger.warning('[Store:{}] Revision {} is quarantined ({}), it is not applied'.format(
+                    self.store.name, available_revision, revision.quarantine_reason
+                ))
+                return
+
             offers = self._extract(available_revision)
+            # offers are compared with last applied revision, so quarantined ones are skipped
             filtered = self._filter(offers, self.store.last_update_revision)
+
+            if revision is not None and not revision.approved:
+                revision.quarantine_reason = self.store.check_offer_changes(filtered['added'], filtered['deleted'])
+                if revision.quarantine_reason:
+                    revision.save(update_fields=['quarantine_reason'])
+                    logger.warning('[Store:{}] Revision {} is quarantined: {}'.format(
+                        self.store.name, available_revision, revision.quarantine_reason
+                    ))
+                    return
+
             self.store.update_offers(
                 revision_number=available_revision,
                 added=filtered['added'],
@@ -62,6 +107,10 @@ class DataSourceImpl:
 
 
 class XmlDataSourceImpl(DataSourceImpl):
+    BACKFILL_BATCH_SIZE = 1000
+
+    class InvalidFeed(Exception):
+        pass
 
     def fetch(self, headers=None):
         """
@@ -75,33 +124,125 @@ class XmlDataSourceImpl(DataSourceImpl):
 
         filename = '{}.xml'.format(self.store.name.lower())
 
-        request = Request(data_source_url, headers=headers or {})
-        response = urlopen(request)
+        headers = dict(headers or {})
+        headers.update(self._conditional_headers())
+
+        request = Request(data_source_url, headers=headers)
+        try:
+            response = urlopen(request, timeout=settings.ST_FETCH_TIMEOUT)
+        except HTTPError as e:
+            if e.code != 304:
+                raise
+
+            logger.info('[Store:{}] Data has not been modified since last fetch'.format(self.store.name))
+            return None
 
         chunk_size = 16 * 1024
-        with self.ds_manager.save(filename) as buffer:
-            while True:
-                chunk = response.read(chunk_size)
-                if not chunk:
-                    break
+        feed_parser = self._feed_parser() if settings.ST_FETCH_PARSE_WHILE_DOWNLOADING else None
+        try:
+            with self.ds_manager.save(filename) as buffer:
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+
+                    buffer.write(chunk)
+                    if feed_parser is not None:
+                        feed_parser.feed(chunk)
+
+                offers = feed_parser.close() if feed_parser is not None else None
+        except etree.XMLSyntaxError as e:
+            raise XmlDataSourceImpl.InvalidFeed(
+                '[Store:{}] Fetched data is not valid XML, it was not saved: {}'.format(self.store.name, e)
+            )
 
-                buffer.write(chunk)
+        if feed_parser is not None and feed_parser.path is not None:
+            # update of this revision does not have to parse it again
+            self.snapshots.save(
+                self.ds_manager.last_revision_number(),
+                self.store.data_source.child.version_hash,
+                self._unique_offers(offers)
+            )
 
+        self._save_validators(response)
         return filename
 
+    def _feed_parser(self):
+        """
+        Data is parsed while it is downloaded, so truncated or malformed data is rejected
+        before it is saved. Offers are extracted on the fly into snapshot of new revision,
+        if snapshots are enabled and offers_xpath is streamable.
+        """
+        data_source = self.store.data_source.child
+        if not self.snapshots.enabled or not STREAMABLE_XPATH_RE.match(data_source.offers_xpath):
+            return FeedParser()
+
+        return FeedParser(data_source.offers_xpath.split('/')[1:], get_field_extractor(data_source))
+
+    def _conditional_headers(self):
+        """
+        Returns headers, which make server respond with 304 Not Modified,
+        if data has not changed since last fetch.
+        """
+        if not self.ds_manager.exists():
+            return {}  # nothing was saved yet or content of last revision was lost, so data has to be fetched anyway
+
+        headers = {}
+        if self.store.last_fetch_etag:
+            headers['If-None-Match'] = self.store.last_fetch_etag
+        if self.store.last_fetch_last_modified:
+            headers['If-Modified-Since'] = self.store.last_fetch_last_modified
+
+        return headers
+
+    def _save_validators(self, response):
+        content_length = response.headers.get('Content-Length')
+
+        self.store.last_fetch_etag = response.headers.get('ETag', '')
+        self.store.last_fetch_last_modified = response.headers.get('Last-Modified', '')
+        self.store.last_fetch_content_length = int(content_length) if content_length else None
+        self.store.save(
+            update_fields=['last_fetch_etag', 'last_fetch_last_modified', 'last_fetch_content_length']
+        )
+
     def _extract(self, revision):
+        data_source = self.store.data_source.child
+        offers = self.snapshots.load(revision, data_source.version_hash)
+        if offers is not None:
+            logger.info('[Store:{}] Offers loaded from snapshot (revision:{})'.format(self.store.name, revision))
+            return offers
+
         logger.info('[Store:{}] Extracting data from XML (revision:{})...'.format(self.store.name, revision))
 
         file_name = '{}.xml'.format(self.store.name.lower())
-        file_content = self.ds_manager.get(file_name, revision)
-        unique_offers = {}
+        feed = self.ds_manager.open(file_name, revision)
+        extractor = get_field_extractor(data_source)
+        offers_xpath = data_source.offers_xpath
+
+        offer_dicts = None
+        if self._is_extracted_sharded(revision, offers_xpath):
+            content = feed.read()
+            offer_dicts = self._extract_sharded(content, offers_xpath, extractor)
+            feed = BytesIO(content)  # in case XML has to be extracted in this process
+
+        if offer_dicts is None:
+            nodes = self._iter_offers(feed, offers_xpath)
+            offer_dicts = (self._node_to_dict(node, extractor) for node in nodes)
+
+        offers = self._unique_offers(offer_dicts)
+        self.snapshots.save(revision, data_source.version_hash, offers)
+        return offers
 
-        for node in self._get_list_of_offers(file_content):
-            offer = self._node_to_dict(node)
+    def _unique_offers(self, offer_dicts):
+        """
+        External ids are compared as integers, as they are stored, so e.g. "1" and "01" are the same offer
+        """
+        unique_offers = {}
+        for offer in offer_dicts:
             external_id = offer['external_id']  # TODO: add exception - external_id is required
 
-            if external_id not in unique_offers.keys():
-                unique_offers[external_id] = offer
+            if int(external_id) not in unique_offers.keys():
+                unique_offers[int(external_id)] = offer
             else:
                 logger.warning(
                     '[Store:{}] Offer with external_id "{}" is not unique!'.format(self.store.name, external_id)
@@ -109,7 +250,82 @@ class XmlDataSourceImpl(DataSourceImpl):
 
         return list(unique_offers.values())
 
+    def _is_extracted_sharded(self, revision, offers_xpath):
+        """
+        Size of revision is checked in catalog, so smaller feeds are streamed
+        instead of being read into memory.
+        """
+        if settings.ST_EXTRACT_PROCESSES <= 1 or not STREAMABLE_XPATH_RE.match(offers_xpath):
+            return False
+
+        return self.ds_manager.revision(revision).size >= settings.ST_SHARDED_EXTRACT_MIN_SIZE
+
+    def _extract_sharded(self, content, offers_xpath, extractor):
+        """
+        Big feeds are split into ranges of offers, which are extracted in
+        ST_EXTRACT_PROCESSES worker processes at the same time.
+        :param content: bytes of XML
+        :return: list of offer dicts, None if feed has to be extracted in this process
+        """
+        logger.info('[Store:{}] Parsing XML ({} processes)...'.format(self.store.name, settings.ST_EXTRACT_PROCESSES))
+        try:
+            return extract_sharded(content, offers_xpath.split('/')[1:], extractor, settings.ST_EXTRACT_PROCESSES)
+        except ShardParseError as e:
+            logger.warning(
+                '[Store:{}] XML can not be extracted in parts ({}), it is extracted at once'.format(self.store.name, e)
+            )
+            return None
+
     def _filter(self, offers, prev_rev_number):
+        """
+        Compares offers with fingerprints of offers stored in database, previous revision
+        is extracted again only if some stored offers do not have fingerprints yet,
+        fingerprints of offers, which have not changed, are stored then.
+        """
+        stored = self._stored_fingerprints()
+        if stored is None:
+            return self._filter_by_revision(offers, prev_rev_number)
+
+        logger.info('[Store:{}] Filtering by fingerprints of offers stored in database...'.format(self.store.name))
+        old_ids, old_fingerprints, old_outdated = stored
+        new_ids = np.fromiter((int(offer['external_id']) for offer in offers), dtype=np.int64, count=len(offers))
+        new_fingerprints = np.fromiter((get_fingerprint(offer) for offer in offers), dtype=np.int64, count=len(offers))
+
+        diff = diff_fingerprints(old_ids, old_fingerprints, new_ids, new_fingerprints, old_outdated)
+
+        return {
+            'added': [offers[i] for i in diff['added']],
+            'deleted': [{'external_id': int(old_ids[i])} for i in diff['deleted']],
+            'modified': [offers[i] for i in diff['modified']],
+        }
+
+    def _stored_fingerprints(self):
+        """
+        :return: tuple of arrays (external ids, fingerprints, outdated) of active offers of store,
+                 outdated offers have fingerprints computed by other version of data source.
+                 None if some of offers were stored without fingerprint
+        """
+        version_hash = self.store.data_source.version_hash
+        ids, fingerprints, outdated = [], [], []
+        offers = Offer.objects.filter(store=self.store, is_active=True).values_list(
+            'external_id', 'fingerprint', 'fingerprint_version'
+        )
+
+        for external_id, fingerprint, fingerprint_version in offers.iterator():
+            if fingerprint is None:
+                return None
+
+            ids.append(external_id)
+            fingerprints.append(fingerprint)
+            outdated.append(fingerprint_version != version_hash)
+
+        return (
+            np.array(ids, dtype=np.int64),
+            np.array(fingerprints, dtype=np.int64),
+            np.array(outdated, dtype=bool),
+        )
+
+    def _filter_by_revision(self, offers, prev_rev_number):
         logger.info(
             '[Store:{}] Filtering by data from previous version of XML (revision:{})...'.format(
                 self.store.name, prev_rev_number
@@ -135,44 +351,70 @@ class XmlDataSourceImpl(DataSourceImpl):
         offers_modified = (
             [new_offer_dicts[key] for key in offers_in_db_and_xml]
             if datasource_changed else
-            [new_offer_dicts[key] for key in offers_in_db_and_xml if old_offer_dicts[key] != new_offer_dicts[key]]
+            [
+                ModifiedOffer(new_offer_dicts[key], self._changed_fields(old_offer_dicts[key], new_offer_dicts[key]))
+                for key in offers_in_db_and_xml if old_offer_dicts[key] != new_offer_dicts[key]
+            ]
         )
 
+        if not datasource_changed:
+            self._backfill_fingerprints(
+                new_offer_dicts[key] for key in offers_in_db_and_xml if old_offer_dicts[key] == new_offer_dicts[key]
+            )
+
         return {
             'added': offers_added,
             'deleted': offers_deleted,
             'modified': offers_modified,
         }
 
-    def _get_list_of_offers(self, file_content):
-        logger.info('[Store:{}] Parsing XML...'.format(self.store.name))
-        parser = etree.XMLParser(huge_tree=True)
-        logger.info('[Store:{}] Parsing went well :)'.format(self.store.name))
-        root = etree.fromstring(str.encode(file_content), parser)
-        offers = list(root.xpath(self.store.data_source.child.offers_xpath))
-        return offers
-
-    def _node_to_dict(self, node):
-        offer_dict = {}
-        for field in self.store.data_source.child.fields:
-            if not field.xpath:
-                offer_dict[field.name.name] = None
-                continue
+    def _backfill_fingerprints(self, unchanged_offers):
+        """
+        Stores fingerprints of unchanged offers, which were saved without them (e.g. before
+        fingerprints were introduced), so next update does not extract previous revision again.
+        Added and modified offers get their fingerprints when they are saved.
+        """
+        fingerprints = {int(offer['external_id']): get_fingerprint(offer) for offer in unchanged_offers}
+        version_hash = self.store.data_source.version_hash
 
-            offer_dict[field.name.name] = node.xpath(field.xpath)
+        offers = []
+        missing = Offer.objects.filter(store=self.store, is_active=True, fingerprint__isnull=True).only('external_id')
+        for offer in missing.iterator():
+            if offer.external_id in fingerprints:
+                offer.fingerprint = fingerprints[offer.external_id]
+                offer.fingerprint_version = version_hash
+                offers.append(offer)
 
-            if len(offer_dict[field.name.name]) == 0:
-                offer_dict[field.name.name] = None
-            elif len(offer_dict[field.name.name]) == 1:
-                offer_dict[field.name.name] = self._node_to_string(offer_dict[field.name.name][0])
-            else:
-                offer_dict[field.name.name] = [self._node_to_string(li) for li in offer_dict[field.name.name]]
+        Offer.objects.bulk_update(offers, ['fingerprint', 'fingerprint_version'], batch_size=self.BACKFILL_BATCH_SIZE)
 
-        return offer_dict
+    @staticmethod
+    def _changed_fields(old_offer, new_offer):
+        return {
+            key for key in set(old_offer.keys()) | set(new_offer.keys())
+            if key not in old_offer or key not in new_offer or old_offer[key] != new_offer[key]
+        }
 
-    def _node_to_string(self, node):
+    def _iter_offers(self, feed, offers_xpath):
         """
-        Converts lxml.etree._ElementUnicodeResult to str,
-        or whole node to str
+        Yields offer elements one by one from binary file-like feed. If offers_xpath
+        is a simple absolute path, document is streamed with iterparse and every offer
+        element is freed right after it was consumed, otherwise whole tree is built.
         """
-        return str(node) if isinstance(node, str) else etree.tostring(node, encoding='unicode')
+        if not STREAMABLE_XPATH_RE.match(offers_xpath):
+            yield from self._get_list_of_offers(feed, offers_xpath)
+            return
+
+        logger.info('[Store:{}] Parsing XML (streaming)...'.format(self.store.name))
+        yield from iter_offer_nodes(feed, offers_xpath.split('/')[1:])
+
+    def _get_list_of_offers(self, feed, offers_xpath):
+        logger.info('[Store:{}] Parsing XML...'.format(self.store.name))
+        parser = etree.XMLParser(huge_tree=True)
+        root = etree.parse(feed, parser).getroot()
+        logger.info('[Store:{}] Parsing went well :)'.format(self.store.name))
+        offers = list(root.xpath(offers_xpath))
+        return offers
+
+    def _node_to_dict(self, node, extractor=None):
+        extractor = extractor or get_field_extractor(self.store.data_source.child)
+        return extractor(node)
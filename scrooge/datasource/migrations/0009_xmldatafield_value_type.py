@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.0.2 on 2026-10-18 16:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasource', '0008_auto_20160627_2316'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xmldatafield',
+            name='value_type',
+            field=models.CharField(
+                choices=[
+                    ('auto', 'Text or markup, list if there are many values'),
+                    ('str', 'Text (without markup)'),
+                    ('markup', 'Markup of element'),
+                    ('list', 'List of texts'),
+                    ('int', 'Integer'),
+                    ('decimal', 'Decimal'),
+                    ('bool', 'Boolean'),
+                ],
+                default='auto',
+                help_text='Type to which value of field is converted during extraction',
+                max_length=16
+            ),
+        ),
+    ]
@@ -108,7 +108,11 @@ class XmlDataSourceModel(DataSourceModel):
 
     def recalculate_version_hash(self):
         content = self.offers_xpath.encode('utf-8')
-        content += ''.join(['{}{}'.format(field.name, field.xpath) for field in self.fields]).encode('utf-8')
+        content += ''.join([
+            # value_type is included only if it is set, so versions of existing data sources do not change
+            '{}{}{}'.format(field.name, field.xpath, field.value_type if field.value_type != AUTO_VALUE_TYPE else '')
+            for field in self.fields
+        ]).encode('utf-8')
         self.version_hash = md5(content).hexdigest()
 
     @property
@@ -134,6 +138,18 @@ def xpath_validator(value):
         )
 
 
+AUTO_VALUE_TYPE = 'auto'
+VALUE_TYPE_CHOICES = (
+    (AUTO_VALUE_TYPE, _('Text or markup, list if there are many values')),
+    ('str', _('Text (without markup)')),
+    ('markup', _('Markup of element')),
+    ('list', _('List of texts')),
+    ('int', _('Integer')),
+    ('decimal', _('Decimal')),
+    ('bool', _('Boolean')),
+)
+
+
 class XmlDataField(models.Model):
     name = models.ForeignKey(DataSourceFieldName, null=True, on_delete=models.PROTECT)
     xpath = models.CharField(
@@ -144,13 +160,25 @@ class XmlDataField(models.Model):
         validators=[xpath_validator]
     )
     data_source = models.ForeignKey(XmlDataSourceModel, on_delete=models.PROTECT)
+    value_type = models.CharField(
+        default=AUTO_VALUE_TYPE,
+        choices=VALUE_TYPE_CHOICES,
+        help_text=_('Type to which value of field is converted during extraction'),
+        max_length=16,
+    )
 
     class Meta:
         unique_together = (("name", "data_source"),)
 
     def save(self, *args, **kwargs):
         super(XmlDataField, self).save(*args, **kwargs)
-        self.data_source.recalculate_version_hash()
+        # version_hash of data source is persisted, because compiled extractors are cached by it
+        self.data_source.save()
+
+    def delete(self, *args, **kwargs):
+        result = super(XmlDataField, self).delete(*args, **kwargs)
+        self.data_source.save()
+        return result
 
     def __str__(self):
         return '{} - {}'.format(self.name, self.xpath)
@@ -0,0 +1,97 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing import get_context
+from lxml import etree
+
+from scrooge.datasource.extractors import iter_offer_nodes
+
+XML_DECLARATION_RE = re.compile(rb'^\s*<\?xml[^>]*\?>')
+TAG_NAME_ENDS = b' \t\r\n/>'
+
+# content, path and extractor of current extraction, inherited by forked worker processes
+_worker_state = {}
+
+
+class ShardParseError(Exception):
+    pass
+
+
+def split_into_shards(content, path, number_of_shards):
+    """
+    Splits XML content into byte ranges of similar size, every range starts at opening
+    tag of offer element (the last element of path), the last one ends at closing tag
+    of parent of offers.
+    :return: list of (start, end) tuples, empty if offers were not found
+    """
+    if len(path) < 2:
+        return []
+
+    first = _find_tag(content, path[-1], 0)
+    end = content.rfind('</{}>'.format(path[-2]).encode('utf-8'))
+    if first < 0 or end < first:
+        return []
+
+    boundaries = [first]
+    for i in range(1, number_of_shards):
+        boundary = _find_tag(content, path[-1], max(first + (end - first) * i // number_of_shards, boundaries[-1] + 1))
+        if boundary < 0 or boundary >= end:
+            break
+        boundaries.append(boundary)
+
+    return list(zip(boundaries, boundaries[1:] + [end]))
+
+
+def _find_tag(content, tag, start):
+    opening = '<{}'.format(tag).encode('utf-8')
+    position = content.find(opening, start)
+
+    while position >= 0 and content[position + len(opening):position + len(opening) + 1] not in TAG_NAME_ENDS:
+        position = content.find(opening, position + 1)
+
+    return position
+
+
+def extract_sharded(content, path, extractor, processes):
+    """
+    Extracts offers from XML content (bytes) in worker processes, every one of them parses
+    its own range of content. Offers are returned in order of document.
+    :raise ShardParseError: if content could not be split or some range could not be parsed
+    """
+    ranges = split_into_shards(content, path, processes)
+    if not ranges:
+        raise ShardParseError('Offers were not found')
+
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=get_context('fork'),  # content is shared with workers instead of being pickled
+        initializer=_init_worker,
+        initargs=(content, path, extractor)
+    ) as executor:
+        shards = list(executor.map(_extract_shard, *zip(*ranges)))
+
+    if None in shards:
+        raise ShardParseError('Range {}-{} is not valid XML'.format(*ranges[shards.index(None)]))
+
+    return [offer for shard in shards for offer in shard]
+
+
+def _init_worker(content, path, extractor):
+    _worker_state.update(content=content, path=path, extractor=extractor)
+
+
+def _extract_shard(start, end):
+    content, path, extractor = _worker_state['content'], _worker_state['path'], _worker_state['extractor']
+
+    declaration = XML_DECLARATION_RE.match(content)
+    shard = b''.join([
+        declaration.group(0) if declaration else b'',
+        b''.join('<{}>'.format(tag).encode('utf-8') for tag in path[:-1]),
+        content[start:end],
+        b''.join('</{}>'.format(tag).encode('utf-8') for tag in reversed(path[:-1])),
+    ])
+
+    try:
+        return [extractor(node) for node in iter_offer_nodes(BytesIO(shard), path)]
+    except etree.XMLSyntaxError:
+        return None  # exceptions of lxml can not be always pickled
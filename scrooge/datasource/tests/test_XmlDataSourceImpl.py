@@ -1,10 +1,21 @@
+import os
+import shutil
+from datetime import datetime
+from io import BytesIO
+from tempfile import TemporaryDirectory
 from unittest.mock import patch, Mock, MagicMock, call
+from urllib.error import HTTPError
 
+from lxml.etree import XMLSyntaxError
 from test_plus.test import TestCase
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
 from scrooge.datasource.generic import XmlDataSourceImpl
 from scrooge.datasource.models import XmlDataSourceModel, XmlDataField, DataSourceFieldName
-from scrooge.stores.models import Store
+from scrooge.offers.models import Offer, get_fingerprint
+from scrooge.stores.models import FeedRevision, Store
 from scrooge.stores.utils.datastoragemanager import DataStorageManager
 
 
@@ -21,7 +32,8 @@ class TestXmlDataSourceImpl(TestCase):
     @patch('scrooge.datasource.generic.urlopen')
     def test_fetch_and_save_data_to_storage_manager(self, urlopen, data_storage_manager):
         mocked_response = Mock()
-        mocked_response.read.side_effect = [b'data1', b'data1', None]
+        mocked_response.read.side_effect = [b'<offers>', b'</offers>', None]
+        mocked_response.headers = {}
         urlopen.return_value = mocked_response
 
         data_storage_manager.return_value.save = MagicMock()
@@ -31,13 +43,111 @@ class TestXmlDataSourceImpl(TestCase):
         data_storage_manager.assert_has_calls([call(self.store.name)])
         data_storage_manager.return_value.save.assert_has_calls([call('foo.xml')])
 
+    @patch('scrooge.datasource.generic.DataStorageManager')
+    @patch('scrooge.datasource.generic.urlopen')
+    def test_fetch_sends_validators_of_previous_response(self, urlopen, data_storage_manager):
+        mocked_response = Mock()
+        mocked_response.read.side_effect = [b'<offers/>', None, b'<offers/>', None]
+        mocked_response.headers = {'ETag': '"abc"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        urlopen.return_value = mocked_response
+
+        self.store.fetch()
+        self.assertEqual(urlopen.call_args[0][0].headers, {})
+        self.assertEqual(Store.objects.get(id=self.store.id).last_fetch_etag, '"abc"')
+
+        self.store.fetch()
+        self.assertEqual(urlopen.call_args[0][0].headers, {
+            'If-none-match': '"abc"',
+            'If-modified-since': 'Wed, 21 Oct 2015 07:28:00 GMT',
+        })
+
+    @patch('scrooge.datasource.generic.DataStorageManager')
+    @patch('scrooge.datasource.generic.urlopen')
+    def test_fetch_does_not_save_anything_if_data_was_not_modified(self, urlopen, data_storage_manager):
+        self.store.last_fetch_etag = '"abc"'
+        self.store.save()
+        urlopen.side_effect = HTTPError('http://foo.com/xml', 304, 'Not Modified', {}, None)
+
+        self.assertIsNone(self.store.data_source_instance().fetch())
+        self.assertEqual(data_storage_manager.return_value.save.call_count, 0)
+
+    @patch('scrooge.datasource.generic.DataStorageManager')
+    @patch('scrooge.datasource.generic.urlopen')
+    def test_fetch_does_not_send_validators_if_there_is_no_saved_revision(self, urlopen, data_storage_manager):
+        self.store.last_fetch_etag = '"abc"'
+        self.store.save()
+        data_storage_manager.NoRevision = DataStorageManager.NoRevision
+        data_storage_manager.return_value.last_revision_number.side_effect = DataStorageManager.NoRevision()
+        data_storage_manager.return_value.exists.return_value = False
+        mocked_response = Mock()
+        mocked_response.read.side_effect = [b'<offers/>', None]
+        mocked_response.headers = {}
+        urlopen.return_value = mocked_response
+
+        self.store.fetch()
+        self.assertEqual(urlopen.call_args[0][0].headers, {})
+
+    @patch('scrooge.datasource.generic.urlopen')
+    def test_fetch_does_not_send_validators_if_content_of_last_revision_was_lost(self, urlopen):
+        mocked_response = Mock()
+        mocked_response.read.side_effect = [b'<offers/>', None, b'<offers/>', None]
+        mocked_response.headers = {'ETag': '"abc"'}
+        urlopen.return_value = mocked_response
+
+        with TemporaryDirectory() as temp_dir:
+            with override_settings(ST_STORES_DATA_DIR=temp_dir):
+                self.store.fetch()
+                shutil.rmtree(os.path.join(temp_dir, self.store.name))
+
+                self.store.fetch()
+
+        self.assertEqual(urlopen.call_args[0][0].headers, {})
+
+    @patch('scrooge.datasource.generic.DataStorageManager')
+    @patch('scrooge.datasource.generic.urlopen')
+    def test_fetch_rejects_truncated_xml(self, urlopen, data_storage_manager):
+        mocked_response = Mock()
+        mocked_response.read.side_effect = [b'<offers><offer>', b'<id>1</id>', None]
+        mocked_response.headers = {'ETag': '"abc"'}
+        urlopen.return_value = mocked_response
+
+        data_storage_manager.return_value.save = MagicMock()
+
+        with self.assertRaises(XmlDataSourceImpl.InvalidFeed):
+            self.store.fetch()
+
+        save_context = data_storage_manager.return_value.save.return_value
+        self.assertIs(save_context.__exit__.call_args[0][0], XMLSyntaxError)
+        self.assertEqual(Store.objects.get(id=self.store.id).last_fetch_etag, '')
+
+    @override_settings(ST_SNAPSHOTS_MAX_SIZE=0)
+    @patch('scrooge.datasource.generic.DataStorageManager')
+    @patch('scrooge.datasource.generic.urlopen')
+    def test_fetch_accepts_xml_with_comments_and_instructions_before_root(self, urlopen, data_storage_manager):
+        mocked_response = Mock()
+        mocked_response.read.side_effect = [
+            b'<?xml version="1.0"?><?xml-stylesheet type="text/xsl" href="offers.xsl"?><!-- generated -->',
+            b'<offers><offer><id>1</id></offer></offers>',
+            None
+        ]
+        mocked_response.headers = {'ETag': '"abc"'}
+        urlopen.return_value = mocked_response
+
+        data_storage_manager.return_value.save = MagicMock()
+
+        self.store.fetch()
+
+        save_context = data_storage_manager.return_value.save.return_value
+        self.assertIsNone(save_context.__exit__.call_args[0][0])
+        self.assertEqual(Store.objects.get(id=self.store.id).last_fetch_etag, '"abc"')
+
     @patch('scrooge.stores.models.Store.update_offers')
     @patch('scrooge.datasource.generic.DataStorageManager')
     def test_update_should_update_data_only_if_new_revision_is_available(self, data_storage_manager, update_offers):
         self.store.last_update_revision = 42
         self.store.save()
 
-        data_storage_manager.return_value.get.return_value = '<offers></offers>'
+        data_storage_manager.return_value.open.side_effect = lambda f, rev: BytesIO(b'<offers></offers>')
 
         data_storage_manager.return_value.last_revision_number.return_value = 42
         self.store.update()
@@ -89,7 +199,25 @@ class TestUpdateOfXmlDataSourceImpl(TestCase):
             '''
         self.rev1 = None
 
-        self.data_storage_manager.return_value.get.side_effect = lambda f, rev: self.rev0 if rev == 0 else self.rev1
+        self.data_storage_manager.return_value.open.side_effect = lambda f, rev: BytesIO(
+            (self.rev0 if rev == 0 else self.rev1).encode('utf-8')
+        )
+        self.save_offers(revision=0)
+
+    def save_offers(self, revision):
+        """
+        Saves offers of revision in database, as if store was updated to it.
+        """
+        Offer.objects.filter(store=self.store).delete()
+        store = Store.objects.get(id=self.store.id)  # self.store has to load data source on update, as in real run
+        for offer in store.data_source_instance()._extract(revision):
+            Offer.objects.create(
+                store=self.store,
+                external_id=offer['external_id'],
+                name=offer['name'] or '',
+                fingerprint=get_fingerprint(offer),
+                fingerprint_version=self.data_source.version_hash
+            )
 
     def assert_helper(self, call_args, expected):
         """
@@ -154,6 +282,110 @@ class TestUpdateOfXmlDataSourceImpl(TestCase):
         self.assertEqual(self.update_offers.call_count, 1)
         self.assert_helper(self.update_offers.call_args, expected)
 
+    def test_update__previous_revision_is_not_extracted_if_offers_have_fingerprints(self):
+        self.rev1 = self.rev0
+        self.data_storage_manager.return_value.open.reset_mock()
+
+        self.store.update()
+
+        self.assertEqual([args[1] for args, _ in self.data_storage_manager.return_value.open.call_args_list], [1])
+
+    def test_update__fingerprints_of_unchanged_offers_are_stored_when_previous_revision_is_extracted(self):
+        Offer.objects.filter(store=self.store).update(fingerprint=None)
+        self.rev1 = self.rev0
+        open_mock = self.data_storage_manager.return_value.open
+        open_mock.reset_mock()
+
+        self.store.update()
+
+        self.assertEqual([args[1] for args, _ in open_mock.call_args_list], [1, 0])
+        self.assertFalse(Offer.objects.filter(store=self.store, fingerprint__isnull=True).exists())
+
+        self.store.last_update_revision = 1
+        self.data_storage_manager.return_value.last_revision_number.return_value = 2
+        open_mock.reset_mock()
+
+        self.store.update()
+
+        self.assertEqual([args[1] for args, _ in open_mock.call_args_list], [2])
+        self.update_offers.assert_called_with(revision_number=2, added=[], deleted=[], modified=[])
+
+    @patch('scrooge.datasource.generic.urlopen')
+    def test_update__offers_extracted_during_fetch_are_loaded_from_snapshot(self, urlopen):
+        Offer.objects.filter(store=self.store).update(fingerprint=None)
+        self.rev1 = self.rev0
+        mocked_response = Mock()
+        mocked_response.read.side_effect = [self.rev0[:50].encode('utf-8'), self.rev0[50:].encode('utf-8'), None]
+        mocked_response.headers = {}
+        urlopen.return_value = mocked_response
+        self.data_storage_manager.return_value.save = MagicMock()
+
+        with TemporaryDirectory() as temp_dir:
+            with override_settings(ST_STORES_DATA_DIR=temp_dir, ST_SNAPSHOTS_MAX_SIZE=1024 * 1024):
+                self.store.data_source_instance()._extract(0)
+                self.store.fetch()
+                self.data_storage_manager.return_value.open.reset_mock()
+
+                self.store.update()
+
+        self.assertEqual(self.data_storage_manager.return_value.open.call_count, 0)
+        self.update_offers.assert_called_once_with(revision_number=1, added=[], deleted=[], modified=[])
+
+    def test_update__previous_revision_is_loaded_from_snapshot(self):
+        Offer.objects.filter(store=self.store).update(fingerprint=None)
+        self.rev1 = self.rev0
+
+        with TemporaryDirectory() as temp_dir:
+            with override_settings(ST_STORES_DATA_DIR=temp_dir, ST_SNAPSHOTS_MAX_SIZE=1024 * 1024):
+                self.store.data_source_instance()._extract(0)
+                self.data_storage_manager.return_value.open.reset_mock()
+
+                self.store.update()
+
+        self.assertEqual([args[1] for args, _ in self.data_storage_manager.return_value.open.call_args_list], [1])
+        self.update_offers.assert_called_once_with(revision_number=1, added=[], deleted=[], modified=[])
+
+    def test_update__offers_saved_without_fingerprints_are_compared_with_previous_revision(self):
+        Offer.objects.filter(store=self.store).update(fingerprint=None)
+        self.rev0 = '''
+            <offers>
+                <offer><id>1</id><name>AAA</name></offer>
+                <offer><id>2</id></offer>
+            </offers>
+            '''
+        self.rev1 = '''
+            <offers>
+                <offer><id>1</id><name>AAA - aaa</name></offer>
+                <offer><id>2</id><name>BBB</name></offer>
+            </offers>
+            '''
+
+        self.store.update()
+
+        modified = sorted(self.update_offers.call_args[1]['modified'], key=lambda k: k['external_id'])
+        self.assertEqual([offer.changed_fields for offer in modified], [{'name'}, {'name'}])
+
+    def test_update__offers_with_the_same_integer_external_id_are_not_unique(self):
+        self.rev1 = '''
+            <offers>
+                <offer><id>1</id><name>AAA</name></offer>
+                <offer><id>01</id><name>AAA - aaa</name></offer>
+                <offer><id> 2</id><name>BBB</name></offer>
+                <offer><id>2</id><name>BBB</name></offer>
+            </offers>
+            '''
+
+        with self.assertLogs(level='WARNING') as cm:
+            self.store.update()
+
+        self.assertEqual(len(cm.output), 2)
+        self.update_offers.assert_called_once_with(
+            revision_number=1,
+            added=[],
+            deleted=[],
+            modified=[{'external_id': ' 2', 'name': 'BBB'}]
+        )
+
     def test_update__offers_were_deleted(self):
         self.rev1 = "<offers></offers>"
 
@@ -162,8 +394,8 @@ class TestUpdateOfXmlDataSourceImpl(TestCase):
         expected = {
             'added': [],
             'deleted': [
-                {'external_id': '1', 'name': 'AAA'},
-                {'external_id': '2', 'name': 'BBB'},
+                {'external_id': 1},
+                {'external_id': 2},
             ],
             'modified': [],
             'revision_number': 1
@@ -172,6 +404,62 @@ class TestUpdateOfXmlDataSourceImpl(TestCase):
         self.assertEqual(self.update_offers.call_count, 1)
         self.assert_helper(self.update_offers.call_args, expected)
 
+    def quarantine_setup(self):
+        self.store.max_deleted_offers_percent = 50
+        self.store.save()
+        self.revision = FeedRevision.objects.create(store_name='Foo', number=1, fetched_at=datetime.now())
+        self.data_storage_manager.return_value.revision.side_effect = lambda number: FeedRevision.objects.get(
+            store_name='Foo', number=number
+        )
+
+    def test_update__revision_which_deletes_too_many_offers_is_quarantined(self):
+        self.quarantine_setup()
+        self.rev1 = "<offers></offers>"
+
+        self.store.update()
+
+        self.assertEqual(self.update_offers.call_count, 0)
+        self.revision.refresh_from_db()
+        self.assertEqual(self.revision.quarantine_reason, '2 of 2 offers would be deleted (limit: 50%)')
+
+        self.data_storage_manager.return_value.open.reset_mock()
+        self.store.update()
+
+        self.assertEqual(self.update_offers.call_count, 0)
+        self.assertEqual(self.data_storage_manager.return_value.open.call_count, 0)
+
+    def test_update__approved_revision_is_applied_despite_limits(self):
+        self.quarantine_setup()
+        self.revision.approved = True
+        self.revision.save()
+        self.rev1 = "<offers></offers>"
+
+        self.store.update()
+
+        self.assertEqual(self.update_offers.call_count, 1)
+
+    def test_update__next_revision_is_compared_with_last_applied_one_instead_of_quarantined_one(self):
+        self.quarantine_setup()
+        self.revision.quarantine_reason = '2 of 2 offers would be deleted (limit: 50%)'
+        self.revision.save()
+        FeedRevision.objects.create(store_name='Foo', number=2, fetched_at=datetime.now())
+        Offer.objects.filter(store=self.store).update(fingerprint=None)
+        self.data_storage_manager.return_value.last_revision_number.return_value = 2
+        self.data_storage_manager.return_value.open.reset_mock()
+        self.rev1 = '''
+            <offers>
+                <offer><id>1</id><name>AAA - aaa</name></offer>
+                <offer><id>2</id><name>BBB</name></offer>
+            </offers>
+            '''
+
+        self.store.update()
+
+        self.assertEqual([args[1] for args, _ in self.data_storage_manager.return_value.open.call_args_list], [2, 0])
+        self.assertEqual(self.update_offers.call_args[1]['revision_number'], 2)
+        self.assertEqual(self.update_offers.call_args[1]['deleted'], [])
+        self.assertEqual([offer['external_id'] for offer in self.update_offers.call_args[1]['modified']], ['1'])
+
     def test_update__offers_were_added_modified_and_deleted(self):
         self.rev1 = '''
             <offers>
@@ -185,7 +473,7 @@ class TestUpdateOfXmlDataSourceImpl(TestCase):
         self.update_offers.assert_called_once_with(
             revision_number=1,
             added=[{'external_id': '3', 'name': 'CCC'}],
-            deleted=[{'external_id': '2', 'name': 'BBB'}],
+            deleted=[{'external_id': 2}],
             modified=[{'external_id': '1', 'name': 'AAA - aaa'}]
         )
 
@@ -252,3 +540,113 @@ class TestUpdateOfXmlDataSourceImpl(TestCase):
 
         self.assertEqual(self.update_offers.call_count, 1)
         self.assert_helper(self.update_offers.call_args, expected)
+
+    def test_update__offers_xpath_which_can_not_be_streamed_is_evaluated_on_whole_tree(self):
+        self.data_source.offers_xpath = '//offer[price]'
+        self.data_source.save()
+        self.store.last_update_data_source_version_hash = self.data_source.version_hash
+        self.store.save()
+        self.save_offers(revision=0)
+
+        self.rev1 = '''
+            <offers>
+                <offer><id>1</id><name>AAA</name><price>0.00</price></offer>
+                <offer><id>3</id><name>CCC</name></offer>
+            </offers>
+            '''
+
+        self.store.update()
+
+        self.update_offers.assert_called_once_with(
+            revision_number=1,
+            added=[],
+            deleted=[{'external_id': 2}],
+            modified=[]
+        )
+
+    def test_update__streamed_offers_have_to_match_whole_offers_xpath(self):
+        self.rev1 = '''
+            <offers>
+                <offer><id>1</id><name>AAA</name></offer>
+                <offer><id>2</id><name>BBB</name></offer>
+                <bundle><offer><id>3</id><name>CCC</name></offer></bundle>
+            </offers>
+            '''
+
+        self.store.update()
+        self.update_offers.assert_called_once_with(revision_number=1, added=[], deleted=[], modified=[])
+
+    @override_settings(ST_EXTRACT_PROCESSES=2, ST_SHARDED_EXTRACT_MIN_SIZE=0)
+    def test_update__offers_are_extracted_in_processes(self):
+        offer = '<offer><id>{0}</id><name>{0}</name></offer>'
+        self.rev1 = '<offers>{}</offers>'.format(''.join(offer.format(i % 50) for i in range(100)))
+        self.data_storage_manager.return_value.revision.return_value.size = len(self.rev1)
+
+        with self.assertLogs(level='WARNING') as cm:
+            self.store.update()
+
+        self.assertEqual(len(cm.output), 50)  # duplicates are found across all parts of XML
+        self.assertEqual(len(self.update_offers.call_args[1]['added']), 48)
+        self.assertEqual(len(self.update_offers.call_args[1]['modified']), 2)
+
+    @override_settings(ST_EXTRACT_PROCESSES=2, ST_SHARDED_EXTRACT_MIN_SIZE=0)
+    def test_update__offers_are_extracted_in_one_process_if_xml_can_not_be_split(self):
+        self.rev1 = '''
+            <offers>
+                <offer><id>1</id><name>AAA - aaa</name></offer>
+                <offer><id>3</id><name>CCC</name></offer>
+            </offers>
+            <!-- </offers> -->
+            '''
+        self.data_storage_manager.return_value.revision.return_value.size = len(self.rev1)
+
+        with self.assertLogs(level='WARNING'):
+            self.store.update()
+
+        self.update_offers.assert_called_once_with(
+            revision_number=1,
+            added=[{'external_id': '3', 'name': 'CCC'}],
+            deleted=[{'external_id': 2}],
+            modified=[{'external_id': '1', 'name': 'AAA - aaa'}]
+        )
+
+    @override_settings(ST_EXTRACT_PROCESSES=2, ST_SHARDED_EXTRACT_MIN_SIZE=1024)
+    @patch('scrooge.datasource.generic.extract_sharded')
+    def test_update__small_xml_is_streamed_in_one_process(self, extract_sharded):
+        self.rev1 = self.rev0
+        self.data_storage_manager.return_value.revision.return_value.size = len(self.rev1)
+
+        self.store.update()
+
+        extract_sharded.assert_not_called()
+        self.update_offers.assert_called_once_with(revision_number=1, added=[], deleted=[], modified=[])
+
+    def test_update__encoding_declared_in_xml_is_used(self):
+        rev1 = '''<?xml version="1.0" encoding="ISO-8859-2"?>
+            <offers><offer><id>1</id><name>Zażółć</name></offer></offers>
+            '''.encode('iso-8859-2')
+        self.data_storage_manager.return_value.open.side_effect = lambda f, rev: BytesIO(
+            rev1 if rev == 1 else self.rev0.encode('utf-8')
+        )
+
+        self.store.update()
+
+        self.update_offers.assert_called_once_with(
+            revision_number=1,
+            added=[],
+            deleted=[{'external_id': 2}],
+            modified=[{'external_id': '1', 'name': 'Zażółć'}]
+        )
+
+    def test_extract__number_of_queries_does_not_depend_on_number_of_offers(self):
+        offer = '<offer><id>{0}</id><name>{0}</name></offer>'
+        self.rev1 = '<offers>{}</offers>'.format(''.join(offer.format(i) for i in range(100)))
+        data_source_impl = self.store.data_source_instance()
+
+        with CaptureQueriesContext(connection) as rev0_queries:
+            self.assertEqual(len(data_source_impl._extract(0)), 2)
+
+        with CaptureQueriesContext(connection) as rev1_queries:
+            self.assertEqual(len(data_source_impl._extract(1)), 100)
+
+        self.assertLessEqual(len(rev1_queries), len(rev0_queries))
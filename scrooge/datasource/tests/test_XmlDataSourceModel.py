@@ -1,3 +1,4 @@
+from hashlib import md5
 from test_plus.test import TestCase
 
 from scrooge.datasource.models import XmlDataSourceModel, XmlDataField, DataSourceFieldName
@@ -45,3 +46,36 @@ class TestXmlDataSourceModel(TestCase):
         f2.name = name2
         f2.save()
         self.assertNotEqual(version_hash, data_source.version_hash)
+
+    def test__version_hash_is_saved_when_fields_changed(self):
+        data_source = XmlDataSourceModel.objects.create(
+            name='Foo',
+            offers_xpath='/offers/offer',
+            url='http://foo.com/xml'
+        )
+
+        external_id, _ = DataSourceFieldName.objects.get_or_create(name='external_id')
+        field = XmlDataField.objects.create(name=external_id, xpath='./id/text()', data_source=data_source)
+        self.assertEqual(XmlDataSourceModel.objects.get(id=data_source.id).version_hash, data_source.version_hash)
+
+        version_hash = data_source.version_hash
+        field.delete()
+        self.assertNotEqual(XmlDataSourceModel.objects.get(id=data_source.id).version_hash, version_hash)
+
+    def test__version_hash_depends_on_value_type_only_if_it_is_set(self):
+        data_source = XmlDataSourceModel.objects.create(
+            name='Foo',
+            offers_xpath='/offers/offer',
+            url='http://foo.com/xml'
+        )
+
+        external_id, _ = DataSourceFieldName.objects.get_or_create(name='external_id')
+        field = XmlDataField.objects.create(name=external_id, xpath='./id/text()', data_source=data_source)
+        self.assertEqual(
+            data_source.version_hash, md5('/offers/offerexternal_id./id/text()'.encode('utf-8')).hexdigest()
+        )
+
+        version_hash = data_source.version_hash
+        field.value_type = 'int'
+        field.save()
+        self.assertNotEqual(version_hash, data_source.version_hash)
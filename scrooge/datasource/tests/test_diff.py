@@ -0,0 +1,53 @@
+import numpy as np
+from test_plus.test import TestCase
+
+from scrooge.datasource.diff import diff_fingerprints
+
+
+class TestDiffFingerprints(TestCase):
+
+    def diff(self, old, new, old_outdated=None):
+        """
+        :param old: list of (external_id, fingerprint) tuples of stored offers
+        :param new: list of (external_id, fingerprint) tuples of offers from new revision
+        """
+        def to_arrays(offers):
+            return (
+                np.array([external_id for external_id, _ in offers], dtype=np.int64),
+                np.array([fingerprint for _, fingerprint in offers], dtype=np.int64),
+            )
+
+        old_ids, old_fingerprints = to_arrays(old)
+        new_ids, new_fingerprints = to_arrays(new)
+        if old_outdated is not None:
+            old_outdated = np.array(old_outdated, dtype=bool)
+
+        result = diff_fingerprints(old_ids, old_fingerprints, new_ids, new_fingerprints, old_outdated)
+        return {key: indexes.tolist() for key, indexes in result.items()}
+
+    def test_added_deleted_and_modified_offers_are_classified(self):
+        old = [(5, 50), (1, 10), (3, 30), (7, 70)]
+        new = [(3, 30), (8, 80), (1, 11), (2, 20), (7, 70)]
+
+        self.assertEqual(self.diff(old, new), {'added': [1, 3], 'deleted': [0], 'modified': [2]})
+
+    def test_outdated_offers_are_modified_if_they_are_still_present(self):
+        old = [(1, 10), (2, 20), (3, 30)]
+        new = [(1, 10), (2, 20)]
+
+        self.assertEqual(
+            self.diff(old, new, old_outdated=[False, True, True]), {'added': [], 'deleted': [2], 'modified': [1]}
+        )
+
+    def test_all_offers_are_added_if_nothing_is_stored(self):
+        self.assertEqual(self.diff([], [(2, 20), (1, 10)]), {'added': [0, 1], 'deleted': [], 'modified': []})
+
+    def test_all_offers_are_deleted_if_new_revision_is_empty(self):
+        self.assertEqual(self.diff([(2, 20), (1, 10)], []), {'added': [], 'deleted': [0, 1], 'modified': []})
+
+    def test_negative_fingerprints_are_compared(self):
+        big = np.iinfo(np.int64)
+        old = [(1, big.min), (2, big.max)]
+        new = [(1, big.min), (2, big.min)]
+
+        self.assertEqual(self.diff(old, new), {'added': [], 'deleted': [], 'modified': [1]})
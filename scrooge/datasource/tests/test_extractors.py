@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest.mock import Mock
+from lxml import etree
+from test_plus.test import TestCase
+
+from scrooge.datasource.extractors import FieldExtractor, SimplePath, get_field_extractor, to_auto
+
+
+class TestFieldExtractor(TestCase):
+
+    def setUp(self):
+        self.node = etree.fromstring(
+            '<offer id="7" xmlns:g="http://base.google.com/ns/1.0">'
+            '  <title>Foo <b>bold</b> bar<!-- comment -->baz</title>'
+            '  <title lang="en">Foo EN</title>'
+            '  <price>9.99</price>'
+            '  <empty/>'
+            '  <imgs><main url="http://foo.com/1.jpg"/><main url="http://foo.com/2.jpg"/><extra/></imgs>'
+            '  <imgs><main url="http://foo.com/3.jpg"/></imgs>'
+            '  <g:id>g-7</g:id>'
+            '  <authors><author>A</author><author>B</author></authors>'
+            '</offer>'
+        )
+
+    def test_simple_paths_are_resolved_without_xpath_engine(self):
+        for xpath in ['@id', './title', 'price/text()', './imgs/main/@url', './authors/author/text()', 'text()']:
+            self.assertIsInstance(FieldExtractor._compile(xpath), SimplePath, xpath)
+
+        for xpath in ['./title[1]', '//price', 'g:id/text()', '../title', 'string(./price)', './*']:
+            self.assertNotIsInstance(FieldExtractor._compile(xpath), SimplePath, xpath)
+
+    def test_simple_paths_give_the_same_values_as_xpath(self):
+        xpaths = [
+            '@id', '@missing', './title', 'title/text()', './title/@lang', './price/text()', './empty/text()',
+            './empty', './missing/text()', './imgs/main/@url', './imgs/main', './imgs/extra/@url',
+            './authors/author/text()', './authors/text()', 'text()',
+        ]
+        fields = [(xpath, xpath, 'auto') for xpath in xpaths]
+
+        extracted = FieldExtractor(fields)(self.node)
+
+        for xpath in xpaths:
+            expected = FieldExtractor([(xpath, None, 'auto')])
+            expected.fields = [(xpath, etree.XPath(xpath), to_auto)]
+            self.assertEqual(extracted[xpath], expected(self.node)[xpath], xpath)
+
+    def test_values_are_converted_to_declared_types(self):
+        extractor = FieldExtractor([
+            ('id', '@id', 'int'),
+            ('price', './price/text()', 'decimal'),
+            ('bad_price', './title/text()', 'decimal'),
+            ('missing', './missing', 'int'),
+            ('title', './title', 'str'),
+            ('markup', './authors', 'markup'),
+            ('authors', './authors/author', 'list'),
+            ('no_authors', './editors/editor', 'list'),
+            ('has_imgs', 'count(./imgs) > 0', 'bool'),
+        ])
+
+        with self.assertLogs(level='WARNING'):
+            offer = extractor(self.node)
+
+        self.assertEqual(offer, {
+            'id': 7,
+            'price': Decimal('9.99'),
+            'bad_price': None,
+            'missing': None,
+            'title': 'Foo bold barbaz',
+            'markup': '<authors xmlns:g="http://base.google.com/ns/1.0"><author>A</author><author>B</author></authors>',
+            'authors': ['A', 'B'],
+            'no_authors': [],
+            'has_imgs': True,
+        })
+
+    def test_numbers_returned_by_xpath_functions_are_converted(self):
+        extractor = FieldExtractor([
+            ('imgs', 'count(./imgs/main)', 'int'),
+            ('half', 'count(./imgs) div 4', 'int'),
+            ('price', 'number(./price) * 2', 'decimal'),
+            ('has_imgs', 'count(./imgs)', 'bool'),
+            ('has_editors', 'count(./editors)', 'bool'),
+        ])
+
+        with self.assertLogs(level='WARNING') as cm:
+            offer = extractor(self.node)
+
+        self.assertEqual(len(cm.output), 1)  # 0.5 is not int
+        self.assertEqual(offer, {
+            'imgs': 3,
+            'half': None,
+            'price': Decimal('19.98'),
+            'has_imgs': True,
+            'has_editors': False,
+        })
+
+
+class TestGetFieldExtractor(TestCase):
+
+    def test_extractors_are_cached_per_version_of_data_source_and_thread(self):
+        data_source = Mock(version_hash='get_field_extractor_test')
+        data_source.fields.select_related.return_value = []
+
+        extractor = get_field_extractor(data_source)
+        self.assertIs(get_field_extractor(data_source), extractor)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            other_thread_extractor = executor.submit(get_field_extractor, data_source).result()
+            self.assertIs(executor.submit(get_field_extractor, data_source).result(), other_thread_extractor)
+
+        self.assertIsNot(other_thread_extractor, extractor)
+        self.assertEqual(data_source.fields.select_related.call_count, 2)
@@ -0,0 +1,50 @@
+from test_plus.test import TestCase
+
+from scrooge.datasource.extractors import FieldExtractor
+from scrooge.datasource.sharding import ShardParseError, extract_sharded, split_into_shards
+
+
+class TestSharding(TestCase):
+
+    def setUp(self):
+        self.extractor = FieldExtractor([('external_id', './id/text()', 'auto'), ('name', './name/text()', 'auto')])
+        self.content = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<offers>\n'
+            '  <offer><id>1</id><name>Zażółć</name></offer>\n'
+            '  <offer-group><offer><id>100</id></offer></offer-group>\n'
+            '  <offer id="x"><id>2</id><name>BBB</name></offer>\n'
+            '  <offer><id>3</id><name>CCC</name></offer>\n'
+            '  <offer><id>4</id><name>DDD</name></offer>\n'
+            '</offers>\n'
+        ).encode('utf-8')
+
+    def test_shards_start_at_offer_elements(self):
+        shards = split_into_shards(self.content, ['offers', 'offer'], 3)
+
+        self.assertGreater(len(shards), 1)
+        for start, end in shards:
+            self.assertTrue(self.content[start:end].startswith(b'<offer'))
+            self.assertFalse(self.content[start:end].startswith(b'<offer-'))
+        self.assertTrue(self.content[shards[-1][1]:].startswith(b'</offers>'))
+        self.assertEqual([end for _, end in shards[:-1]], [start for start, _ in shards[1:]])
+
+    def test_there_are_no_shards_if_offers_are_not_found(self):
+        self.assertEqual(split_into_shards(self.content, ['offers', 'product'], 3), [])
+        self.assertEqual(split_into_shards(self.content, ['offers'], 3), [])
+
+    def test_offers_are_extracted_in_order_of_document(self):
+        offers = extract_sharded(self.content, ['offers', 'offer'], self.extractor, 3)
+
+        self.assertEqual(offers, [
+            {'external_id': '1', 'name': 'Zażółć'},
+            {'external_id': '2', 'name': 'BBB'},
+            {'external_id': '3', 'name': 'CCC'},
+            {'external_id': '4', 'name': 'DDD'},
+        ])
+
+    def test_shard_which_is_not_valid_xml_raises_exception(self):
+        content = self.content.replace(b'<name>CCC</name>', b'<name>CCC</nam>')
+
+        with self.assertRaises(ShardParseError):
+            extract_sharded(content, ['offers', 'offer'], self.extractor, 3)
@@ -29,8 +29,10 @@ class OfferAdmin(admin.ModelAdmin):
         'name',
         get_url,
         'price',
-        get_store
+        get_store,
+        'is_active',
     )
+    list_filter = ('is_active',)
 
 
 admin.site.register(Offer, OfferAdmin)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.0.2 on 2026-10-18 14:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0002_auto_20160606_2315'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offer',
+            name='is_active',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='offer',
+            name='deactivated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(
+                condition=models.Q(is_active=True), fields=['store', 'external_id'], name='offer_active_idx'
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.0.2 on 2026-10-18 15:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0003_offer_is_active'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offer',
+            name='fingerprint',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='offer',
+            name='fingerprint_version',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32),
+        ),
+    ]
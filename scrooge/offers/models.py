@@ -1,6 +1,9 @@
+import json
 from decimal import Decimal
+from hashlib import blake2b
 
 from django.db import models
+from django.db.models import Q
 from django.contrib.postgres.fields import JSONField
 
 
@@ -14,8 +17,19 @@ class Offer(models.Model):
 
     data = JSONField(default=dict, blank=True)
 
+    # offers removed from data source are deactivated, so they can be reactivated if they come back
+    is_active = models.BooleanField(default=True, editable=False)
+    deactivated_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # fingerprint of extracted offer dict and version_hash of data source, under which it was extracted
+    fingerprint = models.BigIntegerField(null=True, blank=True, editable=False)
+    fingerprint_version = models.CharField(max_length=32, blank=True, default='', editable=False)
+
     class Meta:
         unique_together = (("store", "external_id"),)
+        indexes = [
+            models.Index(fields=['store', 'external_id'], name='offer_active_idx', condition=Q(is_active=True)),
+        ]
 
     def __str__(self):
         return "{} - {} - {}".format(self.external_id, self.name, str(self.price))
@@ -29,3 +43,19 @@ class Offer(models.Model):
         }
         _dict.update(self.data)
         return _dict
+
+
+def get_fingerprint(offer_dict):
+    """
+    Returns 64-bit fingerprint of offer dict extracted from data source. It is stored
+    with offer, so changed offers can be found without reading previous revision of data.
+    """
+    content = json.dumps(offer_dict, sort_keys=True, separators=(',', ':'), default=str)
+    return int.from_bytes(blake2b(content.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+def to_json_value(value):
+    """
+    Decimal values of offer dict are stored in data as JSON numbers
+    """
+    return float(value) if isinstance(value, Decimal) else value
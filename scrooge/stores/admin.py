@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.humanize.templatetags.humanize import naturaltime
 
 from scrooge.offers.models import Offer
-from scrooge.stores.models import Store
+from scrooge.stores.models import FeedRevision, Store
 
 
 def get_enabled(obj):
@@ -13,7 +13,7 @@ get_enabled.boolean = True
 
 
 def get_number_of_offers(obj):
-    return Offer.objects.filter(store=obj).count()
+    return Offer.objects.filter(store=obj, is_active=True).count()
 
 get_number_of_offers.short_description = 'Number of offers'
 
@@ -50,3 +50,27 @@ class StoreAdmin(admin.ModelAdmin):
         return ['last_update_revision', 'last_successful_update', 'last_changing_offers_update']
 
 admin.site.register(Store, StoreAdmin)
+
+
+def get_quarantined(obj):
+    return bool(obj.quarantine_reason)
+
+get_quarantined.short_description = 'Quarantined'
+get_quarantined.boolean = True
+
+
+def approve_revisions(modeladmin, request, queryset):
+    queryset.update(approved=True, quarantine_reason='')
+
+approve_revisions.short_description = 'Approve selected revisions (applied on next update despite limits)'
+
+
+class FeedRevisionAdmin(admin.ModelAdmin):
+    list_display = ('store_name', 'number', 'fetched_at', 'size', get_quarantined, 'quarantine_reason', 'approved')
+    list_filter = ('store_name', 'approved')
+    actions = [approve_revisions]
+
+    def get_readonly_fields(self, request, obj=None):
+        return ['store_name', 'number', 'filename', 'backend', 'storage_key', 'size', 'content_hash', 'fetched_at']
+
+admin.site.register(FeedRevision, FeedRevisionAdmin)
@@ -0,0 +1,52 @@
+import logging
+import traceback
+from django.core.management.base import BaseCommand
+
+from scrooge.stores.models import Store
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '''Remove revisions of data of stores, which are not kept by their retention policies, and compact
+    repositories, in which revisions are stored.'''
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--all', action='store_true', help='Compact archives of all stores defined in database')
+        group.add_argument('store_names', metavar='store_name', nargs='*', default=[])
+        parser.add_argument(
+            '--dry-run', action='store_true', help='Only report revisions, which would be removed'
+        )
+
+    def handle(self, *args, **options):
+        self.err_messages = []
+
+        stores = Store.objects.all() if options['all'] else self.get_stores(options['store_names'])
+
+        for store in stores:
+            try:
+                removed = store.compact_revisions(dry_run=options['dry_run'])
+            except Exception as e:
+                logger.critical('[Store:{}] {}\n{}'.format(store.name, str(e), traceback.format_exc()))
+                self.err_messages.append(e)
+                continue
+
+            logger.info('[Store:{}] Revisions {}: {}'.format(
+                store.name,
+                'to remove' if options['dry_run'] else 'removed',
+                ', '.join(str(number) for number in removed) or 'none'
+            ))
+
+        if self.err_messages:
+            exit(1)
+
+        logger.info('Compaction is finished')
+
+    def get_stores(self, store_names):
+        for name in store_names:
+            try:
+                yield Store.objects.get(name__iexact=name)
+            except Store.DoesNotExist as e:
+                logger.error('[Store:{}] There is no such store defined in database'.format(name.lower()))
+                self.err_messages.append(e)
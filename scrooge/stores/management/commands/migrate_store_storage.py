@@ -0,0 +1,47 @@
+import logging
+import traceback
+from django.core.management.base import BaseCommand
+
+from scrooge.stores.models import Store
+from scrooge.stores.utils.datastoragemanager import DataStorageManager
+from scrooge.stores.utils.storagebackends import STORAGE_BACKENDS
+from scrooge.stores.utils.storelock import store_lock
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '''Copy saved revisions of data of stores to given storage backend. Revisions are not removed
+    from previous backend, so it can be deleted once ST_STORAGE_BACKEND points at the new one.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', required=True, choices=sorted(STORAGE_BACKENDS), help='Target storage backend')
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--all', action='store_true', help='Migrate revisions of all stores defined in database')
+        group.add_argument('store_names', metavar='store_name', nargs='*', default=[])
+
+    def handle(self, *args, **options):
+        self.err_messages = []
+
+        stores = Store.objects.all() if options['all'] else self.get_stores(options['store_names'])
+
+        for store in stores:
+            try:
+                with store_lock(store.name):
+                    DataStorageManager(store.name).migrate(options['to'])
+            except Exception as e:
+                logger.critical('[Store:{}] {}\n{}'.format(store.name, str(e), traceback.format_exc()))
+                self.err_messages.append(e)
+
+        if self.err_messages:
+            exit(1)
+
+        logger.info('Migration is finished')
+
+    def get_stores(self, store_names):
+        for name in store_names:
+            try:
+                yield Store.objects.get(name__iexact=name)
+            except Store.DoesNotExist as e:
+                logger.error('[Store:{}] There is no such store defined in database'.format(name.lower()))
+                self.err_messages.append(e)
@@ -1,12 +1,36 @@
 import logging
 import traceback
-from django.core.management.base import BaseCommand
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 
 from scrooge.stores.models import Store
+from scrooge.stores.utils.concurrentfetcher import ConcurrentFetcher
+from scrooge.stores.utils.storelock import StoreLocked
 
 logger = logging.getLogger(__name__)
 
 
+def fetch_and_update_store(store_id):
+    """
+    Fetches and updates single store, is run in worker process by --jobs option.
+    Exceptions are returned as text, because not all of them can be pickled.
+    :return: tuple (store_name, error_message, formatted_traceback), error_message is None on success
+    """
+    store = Store.objects.get(id=store_id)
+    try:
+        store.fetch()
+        store.update()
+    except StoreLocked as e:
+        logger.info('{}, it is skipped'.format(e))
+    except Exception as e:
+        return store.name, str(e), traceback.format_exc()
+
+    return store.name, None, None
+
+
 class Command(BaseCommand):
     help = '''Fetch and update data for ENABLED stores defined in the database.'''
 
@@ -16,39 +40,115 @@ class Command(BaseCommand):
             '--all', action='store_true', help='Fetch and update data for all enabled stores defined in database'
         )
         group.add_argument('store_names', metavar='store_name', nargs='*', default=[])
+        parser.add_argument(
+            '--fetch-concurrency', type=int, default=1,
+            help='Fetch data of up to N stores at the same time (at most {} from the same host) '
+                 'and then update stores with new data one by one'.format(settings.ST_FETCH_PER_HOST_CONCURRENCY)
+        )
+        parser.add_argument(
+            '--jobs', type=int, default=1, help='Fetch and update up to N stores at the same time in worker processes'
+        )
 
     def handle(self, *args, **options):
+        self.err_messages = []
+
+        if options['jobs'] > 1 and options['fetch_concurrency'] > 1:
+            raise CommandError('--jobs and --fetch-concurrency can not be used together')
 
         stores = Store.objects.all() if options['all'] else self.get_stores(options['store_names'])
-        err_messages = []
-        for store in stores:
-            try:
-                if not store.enabled:
-                    logger.info('Store {} is disabled'.format(store.name))
-                else:
-                    store.fetch()
-                    store.update()
-            except Exception as e:
-                logger.critical('[Store:{}] {}\n{}'.format(store.name, str(e), traceback.format_exc()))
-                err_messages.append(e)
-                logger.info('[Store:{}] Update failed, but trying to finish job for other stores...'.format(store.name))
 
-        if err_messages:
+        if options['jobs'] > 1:
+            self.fetch_and_update_in_processes(stores, options['jobs'])
+        elif options['fetch_concurrency'] > 1:
+            self.fetch_concurrently_and_update(stores, options['fetch_concurrency'])
+        else:
+            for store in stores:
+                try:
+                    if not store.enabled:
+                        logger.info('Store {} is disabled'.format(store.name))
+                    else:
+                        store.fetch()
+                        store.update()
+                except StoreLocked as e:
+                    self.log_skipped(e)
+                except Exception as e:
+                    self.log_failure(store, e, traceback.format_exc())
+
+        if self.err_messages:
             exit(1)
 
         logger.info('Update is finished')
 
+    def fetch_and_update_in_processes(self, stores, jobs):
+        enabled_stores = self.get_enabled_stores(stores)
+
+        # forked workers can not share connections of parent process, they open their own ones
+        connections.close_all()
+
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=get_context('fork')) as executor:
+            futures = [(store, executor.submit(fetch_and_update_store, store.id)) for store in enabled_stores]
+
+            for store, future in futures:
+                try:
+                    _, error_message, formatted_traceback = future.result()
+                except Exception as e:  # worker process died
+                    self.log_failure(store, e, traceback.format_exc())
+                    continue
+
+                if error_message is not None:
+                    self.log_failure(store, error_message, formatted_traceback)
+
+    def fetch_concurrently_and_update(self, stores, concurrency):
+        enabled_stores = self.get_enabled_stores(stores)
+
+        fetcher = ConcurrentFetcher(concurrency, settings.ST_FETCH_PER_HOST_CONCURRENCY)
+        fetched_stores = []
+        for store, e in fetcher.fetch(enabled_stores):
+            if e is None:
+                if store.has_new_revision():
+                    fetched_stores.append(store)
+                else:
+                    logger.info('[Store:{}] Data has not changed, update is skipped'.format(store.name))
+            elif isinstance(e, StoreLocked):
+                self.log_skipped(e)
+            else:
+                self.log_failure(store, e, ''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+
+        for store in fetched_stores:
+            try:
+                store.update()
+            except StoreLocked as e:
+                self.log_skipped(e)
+            except Exception as e:
+                self.log_failure(store, e, traceback.format_exc())
+
+    def get_enabled_stores(self, stores):
+        enabled_stores = []
+        for store in stores:
+            if not store.enabled:
+                logger.info('Store {} is disabled'.format(store.name))
+            else:
+                enabled_stores.append(store)
+
+        return enabled_stores
+
+    @staticmethod
+    def log_skipped(e):
+        # other worker is processing the store right now, so it is not a failure
+        logger.info('{}, it is skipped'.format(e))
+
+    def log_failure(self, store, e, formatted_traceback):
+        logger.critical('[Store:{}] {}\n{}'.format(store.name, str(e), formatted_traceback))
+        self.err_messages.append(e)
+        logger.info('[Store:{}] Update failed, but trying to finish job for other stores...'.format(store.name))
+
     def get_stores(self, store_names):
-        err_messages = []
         for name in store_names:
             try:
                 yield Store.objects.get(name__iexact=name)
             except Store.DoesNotExist as e:
                 logger.error("[Store:{}] There is such store defined in database".format(name.lower()))
-                err_messages.append(e)
+                self.err_messages.append(e)
                 logger.info(
                     '[Store:{}] Update failed, but trying to finish job for other stores...'.format(name.lower())
                 )
-
-        if err_messages:
-            exit(1)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.0.2 on 2026-10-18 12:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stores', '0010_store_last_update_data_source_version_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedRevision',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('store_name', models.CharField(max_length=255)),
+                ('number', models.IntegerField()),
+                ('filename', models.CharField(default='', max_length=64)),
+                ('commit_sha', models.CharField(max_length=40)),
+                ('size', models.BigIntegerField(default=0)),
+                ('content_hash', models.CharField(default='', max_length=64)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('store_name', 'number')},
+                'index_together': {('store_name', 'fetched_at')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.0.2 on 2026-10-18 12:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stores', '0011_feedrevision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='last_fetch_content_length',
+            field=models.BigIntegerField(default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='last_fetch_etag',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='last_fetch_last_modified',
+            field=models.CharField(default='', editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.0.2 on 2026-10-18 16:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stores', '0012_store_last_fetch_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='max_added_offers_percent',
+            field=models.PositiveSmallIntegerField(blank=True, default=None, help_text='Revision, which adds more than this percent of offers, is quarantined instead of applied', null=True),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='max_deleted_offers_percent',
+            field=models.PositiveSmallIntegerField(blank=True, default=None, help_text='Revision, which deletes more than this percent of offers, is quarantined instead of applied', null=True),
+        ),
+        migrations.AddField(
+            model_name='feedrevision',
+            name='approved',
+            field=models.BooleanField(default=False, help_text='If checked, revision is applied even if it exceeds limits of store'),
+        ),
+        migrations.AddField(
+            model_name='feedrevision',
+            name='quarantine_reason',
+            field=models.TextField(blank=True, default='', help_text='If not empty, revision looked suspicious and was not applied to offers of store'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.0.2 on 2026-10-18 17:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stores', '0013_offer_change_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='keep_all_revisions_days',
+            field=models.PositiveSmallIntegerField(default=7, help_text='All fetched revisions of data are kept for this number of days'),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='keep_daily_revisions_days',
+            field=models.PositiveSmallIntegerField(default=30, help_text='Then the last revision of every day is kept for this number of days'),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='keep_weekly_revisions_days',
+            field=models.PositiveSmallIntegerField(blank=True, default=None, help_text='Then the last revision of every week is kept for this number of days, forever if empty', null=True),
+        ),
+    ]
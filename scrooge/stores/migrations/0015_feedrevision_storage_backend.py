@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 3.0.2 on 2026-10-18 18:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stores', '0014_store_revision_retention'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='feedrevision',
+            old_name='commit_sha',
+            new_name='storage_key',
+        ),
+        migrations.AlterField(
+            model_name='feedrevision',
+            name='storage_key',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AddField(
+            model_name='feedrevision',
+            name='backend',
+            field=models.CharField(default='git', max_length=16),
+        ),
+    ]
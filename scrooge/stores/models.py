@@ -1,11 +1,16 @@
 import logging
 from datetime import datetime
 
-from django.db import models, transaction
+from django.conf import settings
+from django.db import connection, models, transaction
 from django.utils.translation import ugettext_lazy as _
 
-from scrooge.offers.models import Offer
+from scrooge.offers.models import Offer, get_fingerprint, to_json_value
 from scrooge.datasource.models import DataSourceModel
+from scrooge.stores.utils.bulkofferapplier import BulkOfferApplier
+from scrooge.stores.utils.datastoragemanager import DataStorageManager
+from scrooge.stores.utils.retention import select_revisions_to_keep
+from scrooge.stores.utils.storelock import store_lock
 
 
 logger = logging.getLogger(__name__)
@@ -27,6 +32,36 @@ class Store(models.Model):
         null=True
     )
     data_source = models.ForeignKey(DataSourceModel, on_delete=models.PROTECT)
+    last_fetch_etag = models.CharField(max_length=255, editable=False, default='')
+    last_fetch_last_modified = models.CharField(max_length=64, editable=False, default='')
+    last_fetch_content_length = models.BigIntegerField(editable=False, default=None, null=True)
+    max_deleted_offers_percent = models.PositiveSmallIntegerField(
+        default=None,
+        null=True,
+        blank=True,
+        help_text=_('Revision, which deletes more than this percent of offers, is quarantined instead of applied')
+    )
+    max_added_offers_percent = models.PositiveSmallIntegerField(
+        default=None,
+        null=True,
+        blank=True,
+        help_text=_('Revision, which adds more than this percent of offers, is quarantined instead of applied')
+    )
+
+    keep_all_revisions_days = models.PositiveSmallIntegerField(
+        default=7,
+        help_text=_('All fetched revisions of data are kept for this number of days')
+    )
+    keep_daily_revisions_days = models.PositiveSmallIntegerField(
+        default=30,
+        help_text=_('Then the last revision of every day is kept for this number of days')
+    )
+    keep_weekly_revisions_days = models.PositiveSmallIntegerField(
+        default=None,
+        null=True,
+        blank=True,
+        help_text=_('Then the last revision of every week is kept for this number of days, forever if empty')
+    )
 
     def data_source_instance(self):
         return self.data_source.child.impl_class(self)
@@ -35,21 +70,105 @@ class Store(models.Model):
         return '{} - {}'.format(self.name, self.url)
 
     def update(self):
-        self.data_source_instance().update()
+        """
+        :raise StoreLocked: if store is fetched or updated by other worker
+        """
+        with store_lock(self.name):
+            self.data_source_instance().update()
 
     def fetch(self):
-        self.data_source_instance().fetch()
+        """
+        :raise StoreLocked: if store is fetched or updated by other worker
+        """
+        with store_lock(self.name):
+            self.data_source_instance().fetch()
+
+    def has_new_revision(self):
+        """
+        :return: True if there is revision newer than the one, to which store was updated last time
+        """
+        revisions = FeedRevision.objects.filter(store_name=self.name)
+        if self.last_update_revision is not None:
+            revisions = revisions.filter(number__gt=self.last_update_revision)
+
+        return revisions.exists()
+
+    def limits_offer_changes(self):
+        return self.max_deleted_offers_percent is not None or self.max_added_offers_percent is not None
+
+    def check_offer_changes(self, added, deleted):
+        """
+        Checks number of offers, which would be added and deleted, against limits of store.
+        Limits are not checked, if store does not have any offers yet.
+        :return: reason, why changes are suspicious, empty string if they are not
+        """
+        number_of_offers = Offer.objects.filter(store=self, is_active=True).count()
+        if not number_of_offers:
+            return ''
+
+        for action, offers, max_percent in (
+            ('deleted', deleted, self.max_deleted_offers_percent),
+            ('added', added, self.max_added_offers_percent),
+        ):
+            if max_percent is not None and len(offers) * 100 > max_percent * number_of_offers:
+                return '{} of {} offers would be {} (limit: {}%)'.format(
+                    len(offers), number_of_offers, action, max_percent
+                )
+
+        return ''
+
+    def revisions_to_keep(self, revisions):
+        """
+        Applies retention policy of store to revisions. Revision, to which store was updated
+        last time, and quarantined revisions are kept regardless of policy.
+        :param revisions: queryset of FeedRevision of store
+        :return: set of numbers of revisions to keep
+        """
+        keep = select_revisions_to_keep(
+            revisions,
+            datetime.now(),
+            self.keep_all_revisions_days,
+            self.keep_daily_revisions_days,
+            self.keep_weekly_revisions_days,
+        )
+        keep.update(revisions.exclude(quarantine_reason='').values_list('number', flat=True))
+        if self.last_update_revision is not None:
+            keep.add(self.last_update_revision)
+
+        return keep
+
+    def compact_revisions(self, dry_run=False):
+        """
+        Removes revisions of store, which are not kept by its retention policy.
+        :return: list of numbers of removed revisions
+        """
+        with store_lock(self.name):
+            ds_manager = DataStorageManager(self.name)
+            keep = self.revisions_to_keep(ds_manager.revisions)
+            if dry_run:
+                return list(ds_manager.revisions.exclude(number__in=keep).values_list('number', flat=True))
+
+            return ds_manager.compact(keep)
 
     def update_offers(self, revision_number, added=None, deleted=None, modified=None):
+        """
+        :param modified: offer dicts, if offer dict has changed_fields attribute (see ModifiedOffer),
+                         only these fields of offer are written
+        :return: dict with number of added, deleted and modified offers
+        """
         added = added or []
         deleted = deleted or []
         modified = modified or []
 
         with transaction.atomic():
 
-            self.__add_offers(added)
-            self.__delete_offers(deleted)
-            self.__modify_offers(modified)
+            if self.__use_bulk_apply(added, deleted, modified):
+                counts = BulkOfferApplier(self).apply(added, deleted, modified)
+            else:
+                self.__add_offers(added)
+                self.__delete_offers(deleted)
+                self.__modify_offers(modified)
+                counts = {'added': len(added), 'deleted': len(deleted), 'modified': len(modified)}
 
             # print('After modify {}'.format(len(connection.queries)))
 
@@ -62,35 +181,63 @@ class Store(models.Model):
 
             self.save()
 
-            logger.info('[Store:{}] {} offers added'.format(self.name, len(added)))
-            logger.info('[Store:{}] {} offers deleted'.format(self.name, len(deleted)))
-            logger.info('[Store:{}] {} offers modified'.format(self.name, len(modified)))
+            logger.info('[Store:{}] {} offers added'.format(self.name, counts['added']))
+            logger.info('[Store:{}] {} offers deleted'.format(self.name, counts['deleted']))
+            logger.info('[Store:{}] {} offers modified'.format(self.name, counts['modified']))
+
+        return counts
+
+    @staticmethod
+    def __use_bulk_apply(added, deleted, modified):
+        """
+        Big changes are applied with set-based statements (PostgreSQL only),
+        small ones offer by offer, with detailed log of changes.
+        """
+        return (
+            connection.vendor == 'postgresql' and
+            len(added) + len(deleted) + len(modified) >= settings.ST_BULK_APPLY_MIN_OFFERS
+        )
 
     def __add_offers(self, offers):
         if not offers:
             return
 
+        # offers, which come back to data source, are reactivated in place
+        inactive_offer_ids = dict(
+            Offer.objects.filter(
+                store=self, is_active=False, external_id__in=[offer_dict['external_id'] for offer_dict in offers]
+            ).values_list('external_id', 'id')
+        )
+
         field_names = [f.name for f in Offer._meta.get_fields()]
         for offer_dict in offers:
             data = {}
+            fingerprint = get_fingerprint(offer_dict)
 
             for offer_key in list(offer_dict.keys()):  # list is needed because of offer_dict.pop
                 if offer_key not in field_names:
-                    data[offer_key] = offer_dict.pop(offer_key)
+                    data[offer_key] = to_json_value(offer_dict.pop(offer_key))
                 elif offer_dict[offer_key] is None:
                     offer_dict.pop(offer_key)
 
-
-            offer = Offer.objects.create(store=self, data=data, **offer_dict)  # TODO: change to bulk_create?
-            logger.info('[Store:{}] New offer: {}'.format(self.name, str(offer)))
+            fingerprint_fields = {'fingerprint': fingerprint, 'fingerprint_version': self.data_source.version_hash}
+            offer_id = inactive_offer_ids.get(int(offer_dict['external_id']))
+            if offer_id is None:
+                # TODO: change to bulk_create?
+                offer = Offer.objects.create(store=self, data=data, **fingerprint_fields, **offer_dict)
+                logger.info('[Store:{}] New offer: {}'.format(self.name, str(offer)))
+            else:
+                offer = Offer(id=offer_id, store=self, data=data, **fingerprint_fields, **offer_dict)
+                offer.save(force_update=True)
+                logger.info('[Store:{}] Reactivated offer: {}'.format(self.name, str(offer)))
 
     def __delete_offers(self, offers):
         if not offers:
             return
 
-        # TODO: "deactivate" offer instead deleting it
-        id_of_offers_to_delete = [offer_dict['external_id'] for offer_dict in offers]
-        Offer.objects.filter(external_id__in=id_of_offers_to_delete).delete()
+        Offer.objects.filter(
+            store=self, is_active=True, external_id__in=[offer_dict['external_id'] for offer_dict in offers]
+        ).update(is_active=False, deactivated_at=datetime.now())
 
     def __modify_offers(self, offers):
         # TODO: change to buld_update? - https://github.com/aykut/django-bulk-update
@@ -144,34 +291,94 @@ class Store(models.Model):
         sorted_modified = sorted(offers, key=lambda d: int(d['external_id']))
 
         sorted_offers_queryset = Offer.objects.filter(
-            external_id__in=[offer_dict['external_id'] for offer_dict in offers]
+            store=self, is_active=True, external_id__in=[offer_dict['external_id'] for offer_dict in offers]
         ).order_by('external_id')
 
         for offer_db, offer_dict in zip(sorted_offers_queryset, sorted_modified):
             changes = ChangeLogger(self.name, offer_db.external_id, logger)
-            for key in set(list(offer_db.to_dict().keys()) + list(offer_dict.keys())):
+            update_fields = set()
+
+            keys = set(list(offer_db.to_dict().keys()) + list(offer_dict.keys()))
+            changed_fields = getattr(offer_dict, 'changed_fields', None)
+            if changed_fields is not None:
+                keys &= changed_fields
+
+            for key in keys:
 
                 if key in core_fields:
                     default_value = next(f for f in Offer._meta.get_fields() if f.name==key).default
                     if key not in offer_dict:
                         changes.add(key, '<no_value>', default_value, db_value_type='<no_type>')
                         setattr(offer_db, key, default_value)
+                        update_fields.add(key)
                     elif offer_dict[key] is None:
                         changes.add(key, getattr(offer_db, key), default_value, mode='warn')
                         setattr(offer_db, key, default_value)
-                    elif getattr(offer_db, key) != type(getattr(offer_db, key))(offer_dict[key]):
+                        update_fields.add(key)
+                    elif getattr(offer_db, key) != self.__to_type_of(getattr(offer_db, key), offer_dict[key]):
                         changes.add(key, getattr(offer_db, key), offer_dict[key])
                         setattr(offer_db, key, offer_dict[key])
+                        update_fields.add(key)
                 else:
-                    if key in offer_db.data and key in offer_dict and offer_db.data[key] != offer_dict[key]:
-                        changes.add(key, offer_db.data[key], offer_dict[key])
-                        offer_db.data[key] = offer_dict[key]
+                    new_value = to_json_value(offer_dict.get(key))
+                    if key in offer_db.data and key in offer_dict and offer_db.data[key] != new_value:
+                        changes.add(key, offer_db.data[key], new_value)
+                        offer_db.data[key] = new_value
+                        update_fields.add('data')
                     elif key in offer_db.data and key not in offer_dict:
                         changes.add(key, offer_db.data[key], '<no_value>', new_value_type='<no_type>')
                         del offer_db.data[key]
+                        update_fields.add('data')
                     elif key not in offer_db.data and key in offer_dict:
-                        changes.add(key, '<no_value>', offer_dict[key], db_value_type='<no_type>')
-                        offer_db.data[key] = offer_dict[key]  # TODO: add initializing by type .price = Decimal(price)
+                        changes.add(key, '<no_value>', new_value, db_value_type='<no_type>')
+                        offer_db.data[key] = new_value
+                        update_fields.add('data')
+
+            fingerprint = get_fingerprint(offer_dict)
+            if (offer_db.fingerprint, offer_db.fingerprint_version) != (fingerprint, self.data_source.version_hash):
+                offer_db.fingerprint = fingerprint
+                offer_db.fingerprint_version = self.data_source.version_hash
+                update_fields.update(['fingerprint', 'fingerprint_version'])
 
             changes.log()
-            offer_db.save()
+            if update_fields:
+                offer_db.save(update_fields=update_fields)  # only changed columns are written
+
+    @staticmethod
+    def __to_type_of(db_value, value):
+        """
+        Values of typed fields are compared directly, text values are converted first
+        """
+        return value if isinstance(value, type(db_value)) else type(db_value)(value)
+
+
+class FeedRevision(models.Model):
+    """
+    Catalog of revisions saved by DataStorageManager. Lookups of revisions are done here,
+    so storages of stores do not have to be scanned. Content of revision is kept by storage
+    backend of given name under storage_key (e.g. sha of commit in git repository).
+    """
+    store_name = models.CharField(max_length=255)
+    number = models.IntegerField()
+    filename = models.CharField(max_length=64, default='')
+    backend = models.CharField(max_length=16, default='git')
+    storage_key = models.CharField(max_length=64)
+    size = models.BigIntegerField(default=0)
+    content_hash = models.CharField(max_length=64, default='')
+    fetched_at = models.DateTimeField()
+    quarantine_reason = models.TextField(
+        default='',
+        blank=True,
+        help_text=_('If not empty, revision looked suspicious and was not applied to offers of store')
+    )
+    approved = models.BooleanField(
+        default=False,
+        help_text=_('If checked, revision is applied even if it exceeds limits of store')
+    )
+
+    class Meta:
+        unique_together = (("store_name", "number"),)
+        index_together = (("store_name", "fetched_at"),)
+
+    def __str__(self):
+        return '{} - rev-{} ({})'.format(self.store_name, self.number, self.fetched_at)
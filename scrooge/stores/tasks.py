@@ -0,0 +1,37 @@
+import logging
+
+from config import celery_app
+from scrooge.stores.models import Store
+from scrooge.stores.utils.storelock import StoreLocked
+
+logger = logging.getLogger(__name__)
+
+
+@celery_app.task()
+def update_store(store_id):
+    """
+    Fetches and updates single store. Store locked by other worker is skipped.
+    :return: True if store was updated, False if it was skipped
+    """
+    store = Store.objects.get(id=store_id)
+    try:
+        store.fetch()
+        store.update()
+    except StoreLocked as e:
+        logger.info('{}, it is skipped'.format(e))
+        return False
+
+    return True
+
+
+@celery_app.task()
+def update_enabled_stores():
+    """
+    Queues update of every enabled store, stores are updated in parallel by workers.
+    :return: number of queued stores
+    """
+    store_ids = list(Store.objects.filter(enabled=True).values_list('id', flat=True))
+    for store_id in store_ids:
+        update_store.delay(store_id)
+
+    return len(store_ids)
@@ -0,0 +1,30 @@
+from unittest.mock import patch
+from test_plus.test import TestCase
+
+from django.core.management import call_command
+
+from scrooge.datasource.models import XmlDataSourceModel
+from scrooge.stores.models import Store
+
+
+@patch('scrooge.stores.management.commands.compact_store_archives.Store.compact_revisions')
+class TestCompactStoreArchives(TestCase):
+
+    def setUp(self):
+        foo_ds = XmlDataSourceModel.objects.create(name='Foo', offers_xpath='/whatever', url='http://foo.com/xml')
+        bar_ds = XmlDataSourceModel.objects.create(name='Bar', offers_xpath='/whatever', url='http://bar.com/xml')
+
+        Store.objects.create(name='Foo', enabled=True, url='http://foo.com/', data_source=foo_ds)
+        Store.objects.create(name='Bar', enabled=False, url='http://bar.com/', data_source=bar_ds)
+
+    def test__archives_of_all_stores_are_compacted(self, compact_revisions):
+        compact_revisions.return_value = []
+        call_command('compact_store_archives', '--all')
+
+        self.assertEqual(compact_revisions.call_count, 2)
+
+    def test__dry_run_does_not_remove_revisions(self, compact_revisions):
+        compact_revisions.return_value = [1, 2]
+        call_command('compact_store_archives', 'foo', '--dry-run')
+
+        compact_revisions.assert_called_once_with(dry_run=True)
@@ -0,0 +1,24 @@
+from unittest.mock import patch
+from test_plus.test import TestCase
+
+from django.core.management import call_command
+
+from scrooge.datasource.models import XmlDataSourceModel
+from scrooge.stores.models import Store
+
+
+@patch('scrooge.stores.management.commands.migrate_store_storage.DataStorageManager')
+class TestMigrateStoreStorage(TestCase):
+
+    def setUp(self):
+        foo_ds = XmlDataSourceModel.objects.create(name='Foo', offers_xpath='/whatever', url='http://foo.com/xml')
+        bar_ds = XmlDataSourceModel.objects.create(name='Bar', offers_xpath='/whatever', url='http://bar.com/xml')
+
+        Store.objects.create(name='Foo', url='http://foo.com/', data_source=foo_ds)
+        Store.objects.create(name='Bar', url='http://bar.com/', data_source=bar_ds)
+
+    def test__revisions_of_given_stores_are_migrated(self, data_storage_manager):
+        call_command('migrate_store_storage', 'foo', '--to', 'zstd')
+
+        data_storage_manager.assert_called_once_with('Foo')
+        data_storage_manager.return_value.migrate.assert_called_once_with('zstd')
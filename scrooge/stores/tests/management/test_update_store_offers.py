@@ -1,10 +1,38 @@
+from concurrent.futures import Future
+from datetime import datetime
 from unittest.mock import patch
 from test_plus.test import TestCase
 
 from django.core.management import call_command
+from django.core.management.base import CommandError
 
 from scrooge.datasource.models import XmlDataSourceModel
-from scrooge.stores.models import Store
+from scrooge.stores.models import FeedRevision, Store
+from scrooge.stores.utils.storelock import StoreLocked
+
+
+class ImmediateExecutor:
+    """
+    Replaces ProcessPoolExecutor, runs submitted functions
+    immediately in current process, so mocks can be checked
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
 
 
 @patch('scrooge.stores.management.commands.update_store_offers.Store.update')
@@ -97,3 +125,100 @@ class TestUpdateStoreProducts(TestCase):
         )
 
         self.assertEqual(exception_cm.exception.code, 1)
+
+    @patch('scrooge.stores.management.commands.update_store_offers.Store.has_new_revision', return_value=True)
+    def test__fetch_concurrency__all_enabled_stores_are_fetched_and_updated(self, has_new_revision, fetch, update):
+        call_command('update_store_offers', '--all', '--fetch-concurrency', '4')
+
+        self.assertEqual(fetch.call_count, 3)
+        self.assertEqual(update.call_count, 3)
+
+    @patch('scrooge.stores.management.commands.update_store_offers.Store.has_new_revision', return_value=True)
+    def test__fetch_concurrency__store_is_not_updated_if_its_fetch_failed(self, has_new_revision, fetch, update):
+        def fetch_side_effect():
+            if fetch.call_count == 1:
+                raise Exception('Error1')
+
+        fetch.side_effect = fetch_side_effect
+
+        with self.assertRaises(SystemExit) as exception_cm:
+            with self.assertLogs(level='WARNING') as logger_cm:
+                call_command('update_store_offers', 'Foo', 'Bar', 'Qux', '--fetch-concurrency', '2')
+
+        self.assertEqual(len(logger_cm.output), 1)
+        self.assertIn("[Store:", logger_cm.output[0])
+        self.assertIn("] Error1", logger_cm.output[0])
+        self.assertEqual(fetch.call_count, 3)
+        self.assertEqual(update.call_count, 2)
+        self.assertEqual(exception_cm.exception.code, 1)
+
+    def test__fetch_concurrency__only_stores_with_new_revisions_are_updated(self, fetch, update):
+        Store.objects.filter(name='Bar').update(last_update_revision=0)
+        FeedRevision.objects.create(store_name='Foo', number=0, fetched_at=datetime.now())
+        FeedRevision.objects.create(store_name='Bar', number=0, fetched_at=datetime.now())
+
+        with self.assertLogs(level='INFO') as logger_cm:
+            call_command('update_store_offers', 'Foo', 'Bar', 'Qux', '--fetch-concurrency', '2')
+
+        self.assertEqual(update.call_count, 1)
+        self.assertIn("[Store:Bar] Data has not changed, update is skipped", '\n'.join(logger_cm.output))
+        self.assertIn("[Store:Qux] Data has not changed, update is skipped", '\n'.join(logger_cm.output))
+
+    @patch('scrooge.stores.management.commands.update_store_offers.connections')
+    @patch('scrooge.stores.management.commands.update_store_offers.ProcessPoolExecutor', ImmediateExecutor)
+    def test__jobs__all_enabled_stores_are_updated(self, connections, fetch, update):
+        call_command('update_store_offers', '--all', '--jobs', '4')
+
+        self.assertEqual(fetch.call_count, 3)
+        self.assertEqual(update.call_count, 3)
+
+    @patch('scrooge.stores.management.commands.update_store_offers.connections')
+    @patch('scrooge.stores.management.commands.update_store_offers.ProcessPoolExecutor', ImmediateExecutor)
+    def test__jobs__next_stores_are_updated_if_update_of_prev_store_failed(self, connections, fetch, update):
+        fetch.side_effect = [Exception('Error1'), Exception('2nd Error'), None]
+
+        with self.assertRaises(SystemExit) as exception_cm:
+            with self.assertLogs(level='WARNING') as logger_cm:
+                call_command('update_store_offers', 'Foo', 'Bar', 'Qux', '--jobs', '2')
+
+        self.assertEqual(len(logger_cm.output), 2)
+        self.assertEqual(update.call_count, 1)
+        self.assertIn(
+            "CRITICAL:scrooge.stores.management.commands.update_store_offers:[Store:Foo] Error1",
+            logger_cm.output[0]
+        )
+        self.assertIn(
+            "CRITICAL:scrooge.stores.management.commands.update_store_offers:[Store:Bar] 2nd Error",
+            logger_cm.output[1]
+        )
+        self.assertEqual(exception_cm.exception.code, 1)
+
+    def test__jobs_and_fetch_concurrency_can_not_be_used_together(self, fetch, update):
+        with self.assertRaises(CommandError):
+            call_command('update_store_offers', '--all', '--jobs', '2', '--fetch-concurrency', '2')
+
+    def test__locked_store_is_skipped_without_failure(self, fetch, update):
+        fetch.side_effect = [StoreLocked('[Store:Foo] Store is locked by other process'), None]
+
+        with self.assertLogs(level='INFO') as logger_cm:
+            call_command('update_store_offers', 'Foo', 'Bar')
+
+        self.assertEqual(update.call_count, 1)
+        self.assertIn("[Store:Foo] Store is locked by other process, it is skipped", logger_cm.output[0])
+
+    @patch('scrooge.stores.management.commands.update_store_offers.Store.has_new_revision', return_value=True)
+    def test__fetch_concurrency__locked_store_is_skipped_without_failure(self, has_new_revision, fetch, update):
+        update.side_effect = [StoreLocked('[Store:Foo] Store is locked by other process'), None]
+
+        call_command('update_store_offers', 'Foo', 'Bar', '--fetch-concurrency', '2')
+
+        self.assertEqual(update.call_count, 2)
+
+    @patch('scrooge.stores.management.commands.update_store_offers.connections')
+    @patch('scrooge.stores.management.commands.update_store_offers.ProcessPoolExecutor', ImmediateExecutor)
+    def test__jobs__locked_store_is_skipped_without_failure(self, connections, fetch, update):
+        fetch.side_effect = [StoreLocked('[Store:Foo] Store is locked by other process'), None]
+
+        call_command('update_store_offers', 'Foo', 'Bar', '--jobs', '2')
+
+        self.assertEqual(update.call_count, 1)
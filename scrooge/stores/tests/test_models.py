@@ -1,10 +1,15 @@
+from datetime import datetime
 from decimal import Decimal
+from unittest import skipUnless
+from django.db import connection
 from django.db.utils import IntegrityError
+from django.test.utils import CaptureQueriesContext, override_settings
 from test_plus.test import TestCase
 
+from scrooge.datasource.generic import ModifiedOffer
 from scrooge.datasource.models import XmlDataSourceModel
-from scrooge.offers.models import Offer
-from scrooge.stores.models import Store
+from scrooge.offers.models import Offer, get_fingerprint
+from scrooge.stores.models import FeedRevision, Store
 
 
 class TestStore(TestCase):
@@ -30,6 +35,34 @@ class TestStore(TestCase):
 
         self.assertEqual(self.store.last_update_revision, 0)
 
+    def test_check_offer_changes__reports_changes_over_limits(self):
+        for external_id in range(1, 5):
+            Offer.objects.create(store=self.store, external_id=external_id, name='foo')
+        self.store.max_deleted_offers_percent = 50
+        self.store.max_added_offers_percent = 100
+
+        self.assertEqual(self.store.check_offer_changes(added=[{}] * 4, deleted=[{}] * 2), '')
+        self.assertEqual(
+            self.store.check_offer_changes(added=[], deleted=[{}] * 3),
+            '3 of 4 offers would be deleted (limit: 50%)'
+        )
+        self.assertEqual(
+            self.store.check_offer_changes(added=[{}] * 5, deleted=[]),
+            '5 of 4 offers would be added (limit: 100%)'
+        )
+
+    def test_revisions_to_keep__last_applied_and_quarantined_revisions_are_kept(self):
+        fetched_at = datetime(2000, 1, 3, 12, 0)
+        for number in range(4):
+            FeedRevision.objects.create(store_name='Foo', number=number, fetched_at=fetched_at)
+        FeedRevision.objects.filter(number=1).update(quarantine_reason='2 of 2 offers would be deleted (limit: 50%)')
+        self.store.last_update_revision = 0
+        self.store.keep_weekly_revisions_days = 30
+
+        keep = self.store.revisions_to_keep(FeedRevision.objects.filter(store_name='Foo'))
+
+        self.assertEqual(keep, {0, 1, 3})
+
     def test_update_offers__added(self):
         offer_1 = {
             'external_id': 1,
@@ -61,6 +94,19 @@ class TestStore(TestCase):
         self.assertEqual(Offer.objects.count(), 1)
         self.assertTrue(Offer.objects.filter(store=self.store, data=additional_data_1, **core_data_1).exists())
 
+    def test_update_offers__saves_fingerprints_of_offers(self):
+        offer = {'external_id': '1', 'name': 'some bar', 'author': 'X'}
+        self.store.update_offers(revision_number=0, added=[dict(offer)])
+        self.assertTrue(Offer.objects.filter(
+            fingerprint=get_fingerprint(offer), fingerprint_version=self.store.data_source.version_hash
+        ).exists())
+
+        offer = {'external_id': '1', 'name': 'some bar - 2nd edition'}
+        self.store.update_offers(revision_number=1, modified=[offer])
+        self.assertTrue(Offer.objects.filter(
+            fingerprint=get_fingerprint(offer), fingerprint_version=self.store.data_source.version_hash
+        ).exists())
+
     def test_update_offers__deletes_offers(self):
         offers = [
             {'external_id': 1, 'name': 'some bar 1', 'url': 'http://bar.com/1'},
@@ -70,8 +116,30 @@ class TestStore(TestCase):
         Offer.objects.bulk_create([Offer(store=self.store, **offer) for offer in offers])
 
         self.store.update_offers(revision_number=0, deleted=offers[0:2])
+        self.assertEqual(Offer.objects.filter(is_active=True).count(), 1)
+        self.assertTrue(Offer.objects.filter(store=self.store, is_active=True, **offers[2]).exists())
+        self.assertEqual(Offer.objects.filter(is_active=False, deactivated_at__isnull=False).count(), 2)
+
+    def test_update_offers__deletes_only_offers_of_store(self):
+        other_store = Store.objects.create(name='Bar', data_source=self.store.data_source)
+        Offer.objects.create(store=self.store, external_id=1)
+        Offer.objects.create(store=other_store, external_id=1)
+
+        self.store.update_offers(revision_number=0, deleted=[{'external_id': 1}])
+        self.assertFalse(Offer.objects.get(store=self.store).is_active)
+        self.assertTrue(Offer.objects.get(store=other_store).is_active)
+
+    def test_update_offers__reactivates_offer_which_came_back(self):
+        offer = Offer.objects.create(
+            store=self.store, external_id=1, name='old', price=Decimal('1.99'), data={'a': 1},
+            is_active=False, deactivated_at=datetime.now()
+        )
+
+        self.store.update_offers(revision_number=0, added=[{'external_id': '1', 'name': 'new', 'b': 2}])
         self.assertEqual(Offer.objects.count(), 1)
-        self.assertTrue(Offer.objects.filter(store=self.store, **offers[2]).exists())
+        self.assertTrue(Offer.objects.filter(
+            id=offer.id, name='new', price=Decimal('0.00'), data={'b': 2}, is_active=True, deactivated_at=None
+        ).exists())
 
     def test_update_offers__modify_core_fields_of_offers(self):
         offers = [
@@ -118,6 +186,30 @@ class TestStore(TestCase):
             Offer.objects.filter(store=self.store, **offers[0]).exists()
         )
 
+    def test_update_offers__typed_values_are_compared_and_stored_directly(self):
+        offer = {
+            'external_id': 1, 'name': 'a', 'url': '', 'price': Decimal('9.99'), 'pages': 120, 'weight': Decimal('0.25')
+        }
+        self.store.update_offers(revision_number=0, added=[dict(offer)])
+        self.assertTrue(Offer.objects.filter(price=Decimal('9.99'), data={'pages': 120, 'weight': 0.25}).exists())
+
+        with self.assertLogs(level='WARNING') as cm:
+            self.store.update_offers(revision_number=1, modified=[offer])
+        self.assertIn('No changes, but offer was on "modified" list', cm.output[0])
+
+    def test_update_offers__modify_only_changed_fields_of_offers(self):
+        Offer.objects.create(store=self.store, external_id=1, name='1', price=Decimal('1.99'), data={'a': 0, 'b': 1})
+        modified = ModifiedOffer({'external_id': 1, 'name': 'not written', 'price': '2.99', 'b': 2}, {'price', 'a'})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.store.update_offers(revision_number=0, modified=[modified])
+
+        self.assertTrue(Offer.objects.filter(
+            store=self.store, external_id=1, name='1', price=Decimal('2.99'), data={'b': 1}
+        ).exists())
+        offer_update = next(query['sql'] for query in queries if query['sql'].startswith('UPDATE "offers_offer"'))
+        self.assertNotIn('"name"', offer_update)
+
     def test_update_offers__modify_additional_fields_of_offers(self):
         core_data = [
             {'external_id': 2, 'name': '2', 'url': 'http://bar.com/2', 'price': '9.00'},
@@ -160,3 +252,115 @@ class TestStore(TestCase):
                 for core, data in zip(core_data, additional_data)
             ]
         )
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Bulk apply of offers requires PostgreSQL')
+@override_settings(ST_BULK_APPLY_MIN_OFFERS=1)
+class TestStoreBulkApply(TestCase):
+
+    def setUp(self):
+        data_source = XmlDataSourceModel.objects.create(name='Foo', offers_xpath='/whatever', url='http://foo.com/xml')
+        self.store = Store.objects.create(name='Foo', data_source=data_source)
+        self.other_store = Store.objects.create(name='Bar', data_source=data_source)
+
+    def test_update_offers__added(self):
+        offers = [
+            {'external_id': '1', 'name': 'some bar 1', 'url': 'http://bar.com/1', 'price': '3.14', 'author': 'X'},
+            {'external_id': '2', 'name': 'some bar 2', 'price': None, 'tags': ['a', 'b']},
+        ]
+
+        counts = self.store.update_offers(revision_number=0, added=offers)
+
+        self.assertEqual(counts, {'added': 2, 'deleted': 0, 'modified': 0})
+        self.assertEqual(self.store.last_update_revision, 0)
+        self.assertTrue(Offer.objects.filter(
+            store=self.store, external_id=1, name='some bar 1', url='http://bar.com/1', price=Decimal('3.14'),
+            data={'author': 'X'}
+        ).exists())
+        self.assertTrue(Offer.objects.filter(
+            store=self.store, external_id=2, name='some bar 2', url='', price=Decimal('0.00'), data={'tags': ['a', 'b']}
+        ).exists())
+
+    def test_update_offers__saves_fingerprints_of_offers(self):
+        offer = {'external_id': '1', 'name': 'some bar', 'author': 'X'}
+        self.store.update_offers(revision_number=0, added=[dict(offer)])
+        self.assertTrue(Offer.objects.filter(
+            fingerprint=get_fingerprint(offer), fingerprint_version=self.store.data_source.version_hash
+        ).exists())
+
+        offer = {'external_id': '1', 'name': 'some bar - 2nd edition'}
+        self.store.update_offers(revision_number=1, modified=[offer])
+        self.assertTrue(Offer.objects.filter(
+            fingerprint=get_fingerprint(offer), fingerprint_version=self.store.data_source.version_hash
+        ).exists())
+
+    def test_update_offers__deletes_only_offers_of_store(self):
+        offers = [
+            {'external_id': 1, 'name': 'some bar 1', 'url': 'http://bar.com/1'},
+            {'external_id': 2, 'name': 'some bar 2', 'url': 'http://bar.com/2'},
+        ]
+        Offer.objects.bulk_create([Offer(store=self.store, **offer) for offer in offers])
+        Offer.objects.bulk_create([Offer(store=self.other_store, **offer) for offer in offers])
+
+        counts = self.store.update_offers(revision_number=0, deleted=offers[0:1])
+
+        self.assertEqual(counts, {'added': 0, 'deleted': 1, 'modified': 0})
+        self.assertEqual(Offer.objects.filter(store=self.store, is_active=True).count(), 1)
+        self.assertEqual(Offer.objects.filter(store=self.other_store, is_active=True).count(), 2)
+        self.assertTrue(Offer.objects.filter(
+            store=self.store, external_id=1, is_active=False, deactivated_at__isnull=False
+        ).exists())
+
+    def test_update_offers__modify_offers(self):
+        Offer.objects.create(store=self.store, external_id=1, name='1', price=Decimal('1.99'), data={'a': 0, 'b': 1})
+        Offer.objects.create(store=self.store, external_id=2, name='2', price=Decimal('9.00'))
+        Offer.objects.create(store=self.other_store, external_id=1, name='1', price=Decimal('1.99'))
+
+        counts = self.store.update_offers(revision_number=0, modified=[
+            {'external_id': '1', 'name': '1 - 2nd edition', 'price': None, 'b': 2, 'c': 3},
+        ])
+
+        self.assertEqual(counts, {'added': 0, 'deleted': 0, 'modified': 1})
+        self.assertTrue(Offer.objects.filter(
+            store=self.store, external_id=1, name='1 - 2nd edition', price=Decimal('0.00'), data={'b': 2, 'c': 3}
+        ).exists())
+        self.assertTrue(Offer.objects.filter(store=self.store, external_id=2, name='2', price=Decimal('9.00')).exists())
+        self.assertTrue(Offer.objects.filter(store=self.other_store, external_id=1, name='1').exists())
+
+    def test_update_offers__added_offer_which_already_exists_is_overwritten(self):
+        Offer.objects.create(store=self.store, external_id=1, name='1', price=Decimal('1.99'))
+
+        self.store.update_offers(revision_number=0, added=[{'external_id': 1, 'name': 'new', 'price': '2.99'}])
+
+        self.assertEqual(Offer.objects.count(), 1)
+        self.assertTrue(
+            Offer.objects.filter(store=self.store, external_id=1, name='new', price=Decimal('2.99')).exists()
+        )
+
+    def test_update_offers__reactivates_offer_which_came_back(self):
+        Offer.objects.create(
+            store=self.store, external_id=1, name='old', is_active=False, deactivated_at=datetime.now()
+        )
+
+        counts = self.store.update_offers(revision_number=0, added=[{'external_id': 1, 'name': 'new'}])
+
+        self.assertEqual(counts, {'added': 1, 'deleted': 0, 'modified': 0})
+        self.assertTrue(Offer.objects.filter(
+            store=self.store, external_id=1, name='new', is_active=True, deactivated_at=None
+        ).exists())
+
+    def test_update_offers__modify_only_changed_fields_of_offers(self):
+        Offer.objects.create(store=self.store, external_id=1, name='1', price=Decimal('1.99'), data={'a': 0, 'b': 1})
+        Offer.objects.create(store=self.store, external_id=2, name='2', price=Decimal('1.99'), data={'a': 0})
+
+        self.store.update_offers(revision_number=0, modified=[
+            ModifiedOffer({'external_id': 1, 'name': 'not written', 'price': '2.99', 'b': 2, 'c': 3}, {'b', 'c'}),
+            ModifiedOffer({'external_id': 2, 'name': 'not written', 'price': '2.99'}, {'price'}),
+        ])
+
+        self.assertTrue(Offer.objects.filter(
+            store=self.store, external_id=1, name='1', price=Decimal('1.99'), data={'a': 0, 'b': 2, 'c': 3}
+        ).exists())
+        self.assertTrue(Offer.objects.filter(
+            store=self.store, external_id=2, name='2', price=Decimal('2.99'), data={'a': 0}
+        ).exists())
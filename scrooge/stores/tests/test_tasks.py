@@ -0,0 +1,33 @@
+from unittest.mock import patch
+from test_plus.test import TestCase
+
+from scrooge.datasource.models import XmlDataSourceModel
+from scrooge.stores.models import Store
+from scrooge.stores.tasks import update_enabled_stores, update_store
+from scrooge.stores.utils.storelock import StoreLocked
+
+
+@patch('scrooge.stores.tasks.Store.update')
+@patch('scrooge.stores.tasks.Store.fetch')
+class TestStoreTasks(TestCase):
+
+    def setUp(self):
+        data_source = XmlDataSourceModel.objects.create(name='Foo', offers_xpath='/whatever', url='http://foo.com/xml')
+        self.store = Store.objects.create(name='Foo', data_source=data_source)
+        self.disabled_store = Store.objects.create(name='Bar', enabled=False, data_source=data_source)
+
+    def test_store_is_fetched_and_updated(self, fetch, update):
+        self.assertTrue(update_store(self.store.id))
+        fetch.assert_called_once_with()
+        update.assert_called_once_with()
+
+    def test_locked_store_is_skipped(self, fetch, update):
+        fetch.side_effect = StoreLocked('[Store:Foo] Store is locked by other worker')
+
+        self.assertFalse(update_store(self.store.id))
+        update.assert_not_called()
+
+    @patch('scrooge.stores.tasks.update_store.delay')
+    def test_update_of_enabled_stores_is_queued(self, delay, fetch, update):
+        self.assertEqual(update_enabled_stores(), 1)
+        delay.assert_called_once_with(self.store.id)
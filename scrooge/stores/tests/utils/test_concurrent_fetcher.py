@@ -0,0 +1,59 @@
+import threading
+import time
+from unittest.mock import Mock
+
+from test_plus.test import TestCase
+
+from scrooge.stores.utils.concurrentfetcher import ConcurrentFetcher
+
+
+class TestConcurrentFetcher(TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+
+    def _store(self, name, url, error=None):
+        store = Mock()
+        store.name = name
+        store.data_source.child.url = url
+
+        def fetch():
+            host = url.split('/')[2]
+            with self.lock:
+                self.running[host] = self.running.get(host, 0) + 1
+                self.running['all'] = self.running.get('all', 0) + 1
+                for key in (host, 'all'):
+                    self.max_running[key] = max(self.max_running.get(key, 0), self.running[key])
+
+            time.sleep(0.05)
+
+            with self.lock:
+                self.running[host] -= 1
+                self.running['all'] -= 1
+
+            if error:
+                raise error
+
+        store.fetch.side_effect = fetch
+        return store
+
+    def test_fetch__concurrency_is_limited_in_total_and_per_host(self):
+        stores = [self._store('foo{}'.format(i), 'http://foo.com/{}.xml'.format(i)) for i in range(4)]
+        stores += [self._store('bar{}'.format(i), 'http://bar{}.com/xml'.format(i)) for i in range(4)]
+
+        results = ConcurrentFetcher(concurrency=3, per_host_concurrency=1).fetch(stores)
+
+        self.assertEqual([store for store, _ in results], stores)
+        self.assertEqual([e for _, e in results], [None] * 8)
+        self.assertEqual(self.max_running['foo.com'], 1)
+        self.assertEqual(self.max_running['all'], 3)
+
+    def test_fetch__exceptions_are_returned_for_failed_stores(self):
+        error = Exception('Error1')
+        stores = [self._store('foo', 'http://foo.com/xml', error), self._store('bar', 'http://bar.com/xml')]
+
+        results = ConcurrentFetcher(concurrency=2, per_host_concurrency=2).fetch(stores)
+
+        self.assertEqual(results, [(stores[0], error), (stores[1], None)])
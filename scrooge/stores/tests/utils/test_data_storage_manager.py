@@ -1,10 +1,20 @@
+import hashlib
+import os
+import shutil
 import traceback
+from datetime import datetime, timedelta
 from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import boto3
+from git.exc import GitCommandError
+from moto import mock_s3
 from test_plus.test import TestCase
 
 from django.test.utils import override_settings
 
 from scrooge.stores.utils.datastoragemanager import DataStorageManager
+from scrooge.stores.utils.storagebackends import S3StorageBackend
 
 
 class TestDataStorageManager(TestCase):
@@ -124,3 +134,429 @@ class TestDataStorageManager(TestCase):
                 buffer.write(b'data part 1')
 
             self.assertEqual(ds_manager.last_revision_number(), DataStorageManager.FIRST_REV_NUMBER)
+
+    def test_get_does_not_touch_working_tree(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+
+            for rev in range(2):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write('file content {}'.format(rev).encode())
+
+            head_commit = ds_manager.backend.repo.head.commit
+            self.assertEqual('file content 0', ds_manager.get('file.xml', 0))
+
+            self.assertEqual(ds_manager.backend.repo.head.commit, head_commit)
+            with open(os.path.join(ds_manager.backend.storage_dir, 'file.xml')) as f:
+                self.assertEqual('file content 1', f.read())
+
+    def test_saved_revisions_are_recorded_in_catalog(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(b'data part 1')
+
+            revision = ds_manager.revision(DataStorageManager.FIRST_REV_NUMBER)
+
+        self.assertEqual(revision.filename, 'file.xml')
+        self.assertEqual(revision.size, len(b'data part 1'))
+        self.assertEqual(revision.content_hash, hashlib.sha256(b'data part 1').hexdigest())
+        self.assertEqual(revision.storage_key, ds_manager.backend.repo.head.commit.hexsha)
+
+    def test_revision_at_returns_last_revision_fetched_before_date(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+
+            with self.assertRaises(DataStorageManager.NoRevision):
+                ds_manager.revision_at(datetime.now())
+
+            for rev in range(3):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write('file content {}'.format(rev).encode())
+
+            second_fetched_at = ds_manager.revision(1).fetched_at
+            self.assertEqual(ds_manager.revision_at(second_fetched_at).number, 1)
+            self.assertEqual(ds_manager.revision_at(datetime.now()).number, 2)
+
+    def test_revisions_saved_as_tags_are_imported_to_catalog(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+
+            for rev in range(2):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write('file content {}'.format(rev).encode())
+
+            ds_manager.revisions.delete()
+
+            ds_manager = DataStorageManager(self._func_name())
+            self.assertEqual(ds_manager.last_revision_number(), 1)
+            self.assertEqual(ds_manager.revision(0).size, len('file content 0'))
+            self.assertEqual('file content 0', ds_manager.get('file.xml', 0))
+
+    def test_saving_unchanged_content_does_not_create_new_revision(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(b'data part 1')
+
+            head_commit = ds_manager.backend.repo.head.commit
+
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(b'data part 1')
+
+            self.assertEqual(ds_manager.last_revision_number(), DataStorageManager.FIRST_REV_NUMBER)
+            self.assertEqual(ds_manager.backend.repo.head.commit, head_commit)
+
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(b'data part 2')
+
+            self.assertEqual(ds_manager.last_revision_number(), DataStorageManager.FIRST_REV_NUMBER + 1)
+            self.assertEqual('data part 2', ds_manager.get('file.xml'))
+
+    def test_open_streams_content_without_decoding(self):
+        content = '<?xml version="1.0" encoding="ISO-8859-2"?><offers>Zażółć</offers>'.encode('iso-8859-2')
+
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(content)
+
+            feed = ds_manager.open('file.xml')
+            self.assertEqual(feed.read(10), content[:10])
+            self.assertEqual(feed.read(), content[10:])
+
+    def test_nothing_is_saved_if_exception_is_raised_during_save(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+
+            with self.assertRaises(ValueError):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write(b'data part 1')
+                    raise ValueError()
+
+            with self.assertRaises(DataStorageManager.NoRevision):
+                ds_manager.last_revision_number()
+
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(b'data part 1')
+
+            with self.assertRaises(ValueError):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write(b'data part 2')
+                    raise ValueError()
+
+            self.assertEqual(ds_manager.last_revision_number(), DataStorageManager.FIRST_REV_NUMBER)
+            self.assertFalse(ds_manager.backend.repo.is_dirty())
+            self.assertEqual('data part 1', ds_manager.get('file.xml'))
+
+    def test_compact_removes_revisions_which_are_not_kept(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            for rev in range(5):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write('file content {}'.format(rev).encode())
+
+            self.assertEqual(ds_manager.compact(keep_numbers={1, 3}), [0, 2])
+
+            self.assertEqual(list(ds_manager.revisions.order_by('number').values_list('number', flat=True)), [1, 3, 4])
+            for rev in [1, 3, 4]:
+                self.assertEqual('file content {}'.format(rev), ds_manager.get('file.xml', rev))
+            self.assertEqual(len(list(ds_manager.backend.repo.iter_commits())), 3)
+            self.assertEqual(sorted(tag.name for tag in ds_manager.backend.repo.tags), ['rev-1', 'rev-3', 'rev-4'])
+            self.assertFalse(ds_manager.backend.repo.is_dirty())
+
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(b'file content 5')
+
+            self.assertEqual(ds_manager.last_revision_number(), 5)
+            self.assertEqual('file content 5', ds_manager.get('file.xml'))
+
+    def test_compact_removes_commits_referenced_by_legacy_date_tags(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            repo = ds_manager.backend.repo
+            for rev in range(5):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write('file content {}'.format(rev).encode())
+                # earlier versions tagged every fetch with its date
+                repo.create_tag('date-2020-01-0{}_00-00-00-000000'.format(rev + 1))
+
+            old_commits = [commit.hexsha for commit in repo.iter_commits()]
+
+            ds_manager.compact(keep_numbers={1})
+
+            self.assertEqual(sorted(tag.name for tag in repo.tags), ['rev-1', 'rev-4'])
+            self.assertEqual(len(repo.git.rev_list('--all').split()), 2)
+            for commit in old_commits:
+                with self.assertRaises(GitCommandError):
+                    repo.git.cat_file('-e', commit)
+            self.assertEqual('file content 1', ds_manager.get('file.xml', 1))
+
+    def test_exists_is_false_if_storage_was_lost(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            self.assertFalse(ds_manager.exists())
+
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(b'data part 1')
+            self.assertTrue(ds_manager.exists())
+
+            shutil.rmtree(ds_manager.backend.storage_dir)
+
+            ds_manager = DataStorageManager(self._func_name())
+            self.assertEqual(ds_manager.last_revision_number(), DataStorageManager.FIRST_REV_NUMBER)
+            self.assertFalse(ds_manager.exists())
+
+
+@override_settings(ST_STORAGE_BACKEND='zstd')
+class TestZstdStorageOfDataStorageManager(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _func_name(self):
+        return traceback.extract_stack(None, 2)[0][2]
+
+    def _blobs(self, ds_manager):
+        return sorted(
+            file_name for _, _, file_names in os.walk(ds_manager.backend.storage_dir)
+            for file_name in file_names if file_name.endswith('.zst')
+        )
+
+    def test_exists_is_false_if_blob_was_lost(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(b'data part 1')
+            self.assertTrue(ds_manager.exists())
+
+            os.remove(ds_manager.backend.blob_path(ds_manager.revision(0).storage_key))
+            self.assertFalse(ds_manager.exists())
+
+    def test_revisions_are_saved_as_compressed_blobs(self):
+        content = b'<offers>' + b'<offer>foo</offer>' * 1000 + b'</offers>'
+
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(content[:100])
+                buffer.write(content[100:])
+
+            revision = ds_manager.revision(DataStorageManager.FIRST_REV_NUMBER)
+            blob_path = ds_manager.backend.blob_path(revision.content_hash)
+
+            self.assertEqual(revision.backend, 'zstd')
+            self.assertEqual(revision.storage_key, hashlib.sha256(content).hexdigest())
+            self.assertLess(os.path.getsize(blob_path), len(content) // 10)
+            self.assertFalse(os.path.exists(os.path.join(self.temp_dir.name, self._func_name())))
+
+            feed = ds_manager.open('file.xml')
+            self.assertEqual(feed.read(10), content[:10])
+            self.assertEqual(feed.read(), content[10:])
+
+            with self.assertRaises(DataStorageManager.NoFile):
+                ds_manager.open('other_file.xml')
+
+    def test_the_same_content_is_stored_once(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            for content in [b'data part 1', b'data part 1', b'data part 2', b'data part 1']:
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write(content)
+
+            self.assertEqual(ds_manager.last_revision_number(), 2)
+            self.assertEqual(ds_manager.get('file.xml', 0), 'data part 1')
+            self.assertEqual(ds_manager.get('file.xml', 2), 'data part 1')
+            self.assertEqual(len(self._blobs(ds_manager)), 2)
+
+    def test_nothing_is_saved_if_exception_is_raised_during_save(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+
+            with self.assertRaises(ValueError):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write(b'data part 1')
+                    raise ValueError()
+
+            with self.assertRaises(DataStorageManager.NoRevision):
+                ds_manager.last_revision_number()
+            self.assertEqual(os.listdir(ds_manager.backend.storage_dir), [])
+
+    def test_revisions_are_imported_from_index(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            for rev in range(2):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write('file content {}'.format(rev).encode())
+
+            fetched_at = ds_manager.revision(0).fetched_at
+            ds_manager.revisions.delete()
+
+            ds_manager = DataStorageManager(self._func_name())
+            self.assertEqual(ds_manager.last_revision_number(), 1)
+            self.assertEqual(ds_manager.revision(0).fetched_at, fetched_at)
+            self.assertEqual('file content 0', ds_manager.get('file.xml', 0))
+
+    def test_compact_removes_blobs_which_are_not_used(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            for content in [b'data part 1', b'data part 2', b'data part 1', b'data part 3']:
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write(content)
+
+            self.assertEqual(ds_manager.compact(keep_numbers={2}), [0, 1])
+
+            self.assertEqual(len(self._blobs(ds_manager)), 2)
+            self.assertEqual('data part 1', ds_manager.get('file.xml', 2))
+            self.assertEqual('data part 3', ds_manager.get('file.xml', 3))
+
+            ds_manager.revisions.delete()
+            ds_manager = DataStorageManager(self._func_name())
+            self.assertEqual(list(ds_manager.revisions.order_by('number').values_list('number', flat=True)), [2, 3])
+
+    def test_revisions_are_migrated_between_backends(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name, ST_STORAGE_BACKEND='git'):
+            ds_manager = DataStorageManager(self._func_name())
+            for rev in range(3):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write('file content {}'.format(rev).encode())
+
+            self.assertEqual(ds_manager.migrate('zstd'), 3)
+
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            self.assertEqual(set(ds_manager.revisions.values_list('backend', flat=True)), {'zstd'})
+            for rev in range(3):
+                self.assertEqual('file content {}'.format(rev), ds_manager.get('file.xml', rev))
+
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(b'file content 3')
+
+            self.assertEqual(ds_manager.migrate('git'), 4)
+            self.assertEqual(set(ds_manager.revisions.values_list('backend', flat=True)), {'git'})
+            self.assertEqual('file content 3', ds_manager.get('file.xml', 3))
+
+
+@mock_s3
+@override_settings(ST_STORAGE_BACKEND='s3', ST_S3_BUCKET='scrooge', ST_S3_PART_SIZE=5 * 1024 * 1024)
+class TestS3StorageOfDataStorageManager(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.client = boto3.client('s3', region_name='us-east-1')
+        self.client.create_bucket(Bucket='scrooge')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _func_name(self):
+        return traceback.extract_stack(None, 2)[0][2]
+
+    def _objects(self):
+        return [item['Key'] for item in self.client.list_objects_v2(Bucket='scrooge').get('Contents', [])]
+
+    def test_revisions_are_uploaded_in_parts_and_read_in_ranges(self):
+        content = os.urandom(6 * 1024 * 1024)
+
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name, ST_S3_READ_CHUNK_SIZE=1024 * 1024):
+            ds_manager = DataStorageManager(self._func_name())
+            with ds_manager.save('file.xml') as buffer:
+                for start in range(0, len(content), 1024 * 1024):
+                    buffer.write(content[start:start + 1024 * 1024])
+
+            revision = ds_manager.revision(DataStorageManager.FIRST_REV_NUMBER)
+            self.assertEqual(revision.backend, 's3')
+            self.assertEqual(self._objects(), ['revisions/{}/{}'.format(self._func_name(), revision.storage_key)])
+
+            feed = ds_manager.open('file.xml')
+            self.assertEqual(feed.read(10), content[:10])
+            self.assertEqual(feed.read(), content[10:])
+
+            with self.assertRaises(DataStorageManager.NoFile):
+                ds_manager.open('other_file.xml')
+
+    def test_nothing_is_uploaded_if_exception_is_raised_during_save(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+
+            with self.assertRaises(ValueError):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write(b'x' * 6 * 1024 * 1024)
+                    raise ValueError()
+
+            with self.assertRaises(DataStorageManager.NoRevision):
+                ds_manager.last_revision_number()
+            self.assertEqual(self._objects(), [])
+            self.assertEqual(self.client.list_multipart_uploads(Bucket='scrooge').get('Uploads', []), [])
+
+    def test_exists_is_false_if_object_was_lost(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(b'data part 1')
+            self.assertTrue(ds_manager.exists())
+
+            for key in self._objects():
+                self.client.delete_object(Bucket='scrooge', Key=key)
+            self.assertFalse(ds_manager.exists())
+
+    def test_revisions_can_be_read_by_other_node(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            for content in [b'data part 1', b'data part 1', b'data part 2']:
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write(content)
+
+        with TemporaryDirectory() as other_node_dir:
+            with override_settings(ST_STORES_DATA_DIR=other_node_dir):
+                ds_manager = DataStorageManager(self._func_name())
+
+                self.assertEqual(ds_manager.last_revision_number(), 1)
+                self.assertEqual('data part 1', ds_manager.get('file.xml', 0))
+                self.assertEqual('data part 2', ds_manager.get('file.xml', 1))
+
+    def test_revisions_read_again_are_served_from_local_cache(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            with ds_manager.save('file.xml') as buffer:
+                buffer.write(b'data part 1')
+
+            self.assertEqual('data part 1', ds_manager.get('file.xml'))
+            for key in self._objects():
+                self.client.delete_object(Bucket='scrooge', Key=key)
+
+            self.assertEqual('data part 1', ds_manager.get('file.xml'))
+
+    @patch.object(S3StorageBackend, 'PRUNE_MIN_AGE', timedelta(0))
+    def test_compact_removes_objects_which_are_not_used(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name):
+            ds_manager = DataStorageManager(self._func_name())
+            for rev in range(3):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write('file content {}'.format(rev).encode())
+
+            self.assertEqual(ds_manager.compact(keep_numbers={1}), [0])
+
+            self.assertEqual(len(self._objects()), 2)
+            self.assertEqual('file content 1', ds_manager.get('file.xml', 1))
+            self.assertEqual('file content 2', ds_manager.get('file.xml', 2))
+
+    def test_revisions_are_migrated_from_local_storage(self):
+        with override_settings(ST_STORES_DATA_DIR=self.temp_dir.name, ST_STORAGE_BACKEND='zstd'):
+            ds_manager = DataStorageManager(self._func_name())
+            for rev in range(2):
+                with ds_manager.save('file.xml') as buffer:
+                    buffer.write('file content {}'.format(rev).encode())
+
+            self.assertEqual(ds_manager.migrate('s3'), 2)
+
+        with TemporaryDirectory() as other_node_dir:
+            with override_settings(ST_STORES_DATA_DIR=other_node_dir):
+                ds_manager = DataStorageManager(self._func_name())
+                self.assertEqual('file content 0', ds_manager.get('file.xml', 0))
+                self.assertEqual('file content 1', ds_manager.get('file.xml', 1))
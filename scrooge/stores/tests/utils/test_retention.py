@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+from test_plus.test import TestCase
+
+from scrooge.stores.models import FeedRevision
+from scrooge.stores.utils.retention import select_revisions_to_keep
+
+
+class TestRetention(TestCase):
+
+    def setUp(self):
+        self.now = datetime(2020, 3, 1, 12, 0)
+
+    def revisions(self, *ages):
+        return [
+            FeedRevision(store_name='Foo', number=number, fetched_at=self.now - age)
+            for number, age in enumerate(ages)
+        ]
+
+    def test_all_recent_revisions_are_kept(self):
+        revisions = self.revisions(timedelta(days=2), timedelta(hours=5), timedelta(hours=1))
+        self.assertEqual(select_revisions_to_keep(revisions, self.now, 7, 30), {0, 1, 2})
+
+    def test_last_revision_of_every_day_is_kept(self):
+        revisions = self.revisions(
+            timedelta(days=10, hours=3), timedelta(days=10, hours=2), timedelta(days=9, hours=3), timedelta(hours=1)
+        )
+        self.assertEqual(select_revisions_to_keep(revisions, self.now, 7, 30), {1, 2, 3})
+
+    def test_last_revision_of_every_week_is_kept(self):
+        # 2020-01-08 and 2020-01-10 are in the same week, 2020-01-13 is in the next one
+        revisions = self.revisions(
+            self.now - datetime(2020, 1, 8), self.now - datetime(2020, 1, 10), self.now - datetime(2020, 1, 13),
+        )
+        self.assertEqual(select_revisions_to_keep(revisions, self.now, 7, 30), {1, 2})
+
+    def test_revisions_older_than_weekly_retention_are_dropped_except_the_last_one(self):
+        revisions = self.revisions(timedelta(days=400), timedelta(days=200), timedelta(days=100))
+        self.assertEqual(select_revisions_to_keep(revisions, self.now, 7, 30, 365), {1, 2})
+        self.assertEqual(select_revisions_to_keep(revisions, self.now, 7, 30, 50), {2})
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import time
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest.mock import Mock
+from test_plus.test import TestCase
+
+from django.test.utils import override_settings
+
+from scrooge.stores.models import FeedRevision
+from scrooge.stores.utils.revisioncache import RevisionCache
+from scrooge.stores.utils.storagebackends import NoFile
+
+
+class TestRevisionCache(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.override = override_settings(ST_STORES_DATA_DIR=self.temp_dir.name, ST_REVISION_CACHE_MAX_SIZE=1024)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        self.temp_dir.cleanup()
+
+    def revision(self, content):
+        return FeedRevision(filename='file.xml', content_hash=hashlib.sha256(content).hexdigest())
+
+    def test_content_is_downloaded_only_once(self):
+        fetch = Mock(side_effect=lambda: BytesIO(b'data part 1'))
+        revision = self.revision(b'data part 1')
+
+        self.assertEqual(RevisionCache().open(revision, 'file.xml', fetch).read(), b'data part 1')
+        self.assertEqual(RevisionCache().open(revision, 'file.xml', fetch).read(), b'data part 1')
+        self.assertEqual(fetch.call_count, 1)
+
+        with self.assertRaises(NoFile):
+            RevisionCache().open(revision, 'other_file.xml', fetch)
+
+    def test_broken_file_is_downloaded_again(self):
+        fetch = Mock(side_effect=lambda: BytesIO(b'data part 1'))
+        revision = self.revision(b'data part 1')
+        cache = RevisionCache()
+        cache.open(revision, 'file.xml', fetch)
+
+        with open(os.path.join(cache.files_dir, revision.content_hash), 'wb') as cached_file:
+            cached_file.write(b'data part 2')
+
+        self.assertEqual(cache.open(revision, 'file.xml', fetch).read(), b'data part 1')
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_content_which_does_not_match_revision_is_not_cached(self):
+        revision = self.revision(b'data part 1')
+        cache = RevisionCache()
+
+        with self.assertRaises(RevisionCache.InvalidContent):
+            cache.open(revision, 'file.xml', lambda: BytesIO(b'data part 2'))
+
+        self.assertEqual(os.listdir(cache.files_dir), [])
+        self.assertEqual(os.listdir(cache.temp_dir), [])
+
+    def test_least_recently_used_files_are_evicted(self):
+        cache = RevisionCache()
+        contents = [bytes([i]) * 400 for i in range(3)]
+        for content in contents:
+            cache.open(self.revision(content), 'file.xml', lambda: BytesIO(content))
+            time.sleep(0.01)
+
+        self.assertEqual(
+            sorted(os.listdir(cache.files_dir)),
+            sorted(self.revision(content).content_hash for content in contents[1:])
+        )
+
+    def test_concurrent_readers_download_content_once(self):
+        def fetch():
+            time.sleep(0.1)
+            return BytesIO(b'data part 1')
+
+        fetch = Mock(side_effect=fetch)
+        revision = self.revision(b'data part 1')
+        results = []
+
+        threads = [
+            Thread(target=lambda: results.append(RevisionCache().open(revision, 'file.xml', fetch).read()))
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [b'data part 1'] * 3)
+        self.assertEqual(fetch.call_count, 1)
+
+    @override_settings(ST_REVISION_CACHE_MAX_SIZE=0)
+    def test_disabled_cache_reads_from_storage(self):
+        fetch = Mock(side_effect=lambda: BytesIO(b'data part 1'))
+        revision = self.revision(b'data part 1')
+
+        RevisionCache().open(revision, 'file.xml', fetch)
+        RevisionCache().open(revision, 'file.xml', fetch)
+        self.assertEqual(fetch.call_count, 2)
@@ -0,0 +1,75 @@
+import os
+from decimal import Decimal
+from tempfile import TemporaryDirectory
+from test_plus.test import TestCase
+
+from django.test.utils import override_settings
+
+from scrooge.stores.utils.datastoragemanager import DataStorageManager
+from scrooge.stores.utils.snapshotstorage import SnapshotStorage
+
+
+class TestSnapshotStorage(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+        settings_override = override_settings(ST_STORES_DATA_DIR=self.temp_dir.name, ST_SNAPSHOTS_MAX_SIZE=1024)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.offers = [
+            {'external_id': '1', 'name': 'AAA', 'price': None},
+            {'external_id': 2, 'name': 'BBB', 'tags': ['a', 'b'], 'price': Decimal('9.99'), 'available': True},
+        ]
+
+    def test_saved_offers_are_loaded(self):
+        SnapshotStorage('Foo').save(3, 'hash', self.offers)
+
+        self.assertEqual(SnapshotStorage('Foo').load(3, 'hash'), self.offers)
+
+    def test_snapshot_is_valid_only_for_revision_and_version_of_data_source(self):
+        snapshots = SnapshotStorage('Foo')
+        snapshots.save(3, 'hash', self.offers)
+
+        self.assertIsNone(snapshots.load(2, 'hash'))
+        self.assertIsNone(snapshots.load(3, 'other hash'))
+        self.assertIsNone(SnapshotStorage('Bar').load(3, 'hash'))
+
+    def test_nothing_is_saved_if_snapshots_are_disabled(self):
+        with override_settings(ST_SNAPSHOTS_MAX_SIZE=0):
+            SnapshotStorage('Foo').save(3, 'hash', self.offers)
+
+        self.assertIsNone(SnapshotStorage('Foo').load(3, 'hash'))
+
+    def test_least_recently_used_snapshots_are_evicted(self):
+        offers = [{'external_id': str(i), 'name': 'x' * 100} for i in range(3)]  # ~350 bytes per snapshot
+        foo, bar = SnapshotStorage('Foo'), SnapshotStorage('Bar')
+
+        foo.save(0, 'hash', offers)
+        bar.save(0, 'hash', offers)
+        os.utime(foo._SnapshotStorage__path(0, 'hash'), (0, 0))
+        os.utime(bar._SnapshotStorage__path(0, 'hash'), (1, 1))
+        foo.load(0, 'hash')
+        foo.save(1, 'hash', offers)
+
+        self.assertIsNotNone(foo.load(0, 'hash'))
+        self.assertIsNone(bar.load(0, 'hash'))
+        self.assertIsNotNone(foo.load(1, 'hash'))
+
+    def test_broken_snapshot_is_ignored(self):
+        snapshots = SnapshotStorage('Foo')
+        snapshots.save(3, 'hash', self.offers)
+        with open(snapshots._SnapshotStorage__path(3, 'hash'), 'wb') as snapshot_file:
+            snapshot_file.write(b'\xc1broken')
+
+        with self.assertLogs(level='WARNING'):
+            self.assertIsNone(snapshots.load(3, 'hash'))
+
+    def test_snapshots_are_removed_when_new_storage_is_created(self):
+        SnapshotStorage('Foo').save(0, 'hash', self.offers)
+
+        DataStorageManager('Foo')
+
+        self.assertIsNone(SnapshotStorage('Foo').load(0, 'hash'))
@@ -0,0 +1,99 @@
+import time
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from test_plus.test import TestCase
+
+import fakeredis
+from django.test.utils import override_settings
+
+from scrooge.datasource.models import XmlDataSourceModel
+from scrooge.stores.models import Store
+from scrooge.stores.utils.storelock import FileStoreLock, RedisStoreLock, StoreLocked, store_lock
+
+
+class TestFileStoreLock(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.override = override_settings(ST_STORES_DATA_DIR=self.temp_dir.name, ST_STORE_LOCK_BACKEND='file')
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        self.temp_dir.cleanup()
+
+    def test_store_can_be_locked_only_once(self):
+        with FileStoreLock('Foo'):
+            with self.assertRaises(StoreLocked):
+                with FileStoreLock('Foo'):
+                    pass
+
+            with FileStoreLock('Bar'):
+                pass
+
+        with FileStoreLock('Foo'):
+            pass
+
+    def test_lock_is_released_on_exception(self):
+        with self.assertRaises(ValueError):
+            with FileStoreLock('Foo'):
+                raise ValueError()
+
+        with FileStoreLock('Foo'):
+            pass
+
+    @patch('scrooge.stores.models.Store.data_source_instance')
+    def test_locked_store_is_neither_fetched_nor_updated(self, data_source_instance):
+        data_source = XmlDataSourceModel.objects.create(name='Foo', offers_xpath='/whatever', url='http://foo.com/xml')
+        store = Store.objects.create(name='Foo', data_source=data_source)
+
+        with store_lock('Foo'):
+            with self.assertRaises(StoreLocked):
+                store.fetch()
+            with self.assertRaises(StoreLocked):
+                store.update()
+
+        data_source_instance.assert_not_called()
+
+        store.fetch()
+        store.update()
+        self.assertEqual(data_source_instance.call_count, 2)
+
+
+class TestRedisStoreLock(TestCase):
+
+    def setUp(self):
+        self.client = fakeredis.FakeStrictRedis()
+        self.override = override_settings(ST_STORE_LOCK_LEASE=60)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+
+    def test_store_can_be_locked_only_once(self):
+        with RedisStoreLock('Foo', self.client):
+            with self.assertRaises(StoreLocked):
+                with RedisStoreLock('Foo', self.client):
+                    pass
+
+            with RedisStoreLock('Bar', self.client):
+                pass
+
+        self.assertFalse(self.client.exists(RedisStoreLock.KEY.format('Foo')))
+        with RedisStoreLock('Foo', self.client):
+            pass
+
+    @override_settings(ST_STORE_LOCK_LEASE=0.3)
+    def test_lease_is_renewed_while_lock_is_held(self):
+        with RedisStoreLock('Foo', self.client):
+            time.sleep(0.6)
+            with self.assertRaises(StoreLocked):
+                with RedisStoreLock('Foo', self.client):
+                    pass
+
+    def test_lock_taken_over_by_other_worker_is_not_released(self):
+        with RedisStoreLock('Foo', self.client):
+            # lease of lock has expired and other worker has locked the store
+            self.client.set(RedisStoreLock.KEY.format('Foo'), 'other token')
+
+        self.assertEqual(self.client.get(RedisStoreLock.KEY.format('Foo')), b'other token')
@@ -0,0 +1,204 @@
+import csv
+import json
+from datetime import datetime
+
+from django.db import connection
+
+from scrooge.offers.models import Offer, get_fingerprint, to_json_value
+
+
+class CsvRowsStream:
+    """
+    File-like object, which produces CSV lines from rows generator
+    on demand, so data can be streamed with COPY without building
+    whole file in memory.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._pending = ''
+        self._writer = csv.writer(self, quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n')
+
+    def write(self, line):
+        self._pending += line
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            try:
+                self._writer.writerow(next(self._rows))
+            except StopIteration:
+                break
+
+        size = len(self._pending) if size < 0 else size
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+class BulkOfferApplier:
+    """
+    Applies added, deleted and modified offers of store with a few set-based
+    statements: offers are streamed with COPY into temporary staging table and
+    then inserted (or reactivated), updated and deactivated by joining with it.
+
+    Requires PostgreSQL.
+    """
+    STAGING_TABLE = 'offer_staging'
+    ADDED, DELETED, MODIFIED = 'a', 'd', 'm'
+    NOT_STAGED_FIELDS = ['id', 'store', 'data', 'is_active', 'deactivated_at', 'fingerprint', 'fingerprint_version']
+
+    def __init__(self, store):
+        self.store = store
+        self.table = Offer._meta.db_table
+        self.core_fields = [field for field in Offer._meta.concrete_fields if field.name not in self.NOT_STAGED_FIELDS]
+        self.field_names = [f.name for f in Offer._meta.get_fields()]
+
+    def apply(self, added, deleted, modified):
+        """
+        Has to be called inside transaction.
+        :return: dict with number of added, deleted and modified offers
+        """
+        with connection.cursor() as cursor:
+            self._stage(cursor, added, deleted, modified)
+
+            counts = {
+                'added': self._insert(cursor),
+                'deleted': self._deactivate(cursor),
+                'modified': self._update(cursor),
+            }
+
+            cursor.execute('DROP TABLE {}'.format(self.STAGING_TABLE))
+
+        return counts
+
+    def _stage(self, cursor, added, deleted, modified):
+        columns = ', '.join(
+            '{} {}'.format(self._quote(field.column), field.db_type(connection)) for field in self.core_fields
+        )
+        cursor.execute(
+            'CREATE TEMPORARY TABLE {} (op char(1), {}, '
+            'data jsonb, changed_core jsonb, changed_data jsonb, fingerprint bigint) ON COMMIT DROP'.format(
+                self.STAGING_TABLE, columns
+            )
+        )
+
+        rows = self._rows(((self.ADDED, added), (self.DELETED, deleted), (self.MODIFIED, modified)))
+        cursor.copy_expert(
+            # csv module quotes None as empty string, FORCE_NULL turns it into NULL
+            'COPY {0} (op, {1}, data, changed_core, changed_data, fingerprint) '
+            'FROM STDIN WITH (FORMAT csv, FORCE_NULL ({1}, changed_core, changed_data))'.format(
+                self.STAGING_TABLE, self._columns()
+            ),
+            CsvRowsStream(rows)
+        )
+        cursor.execute('ANALYZE {}'.format(self.STAGING_TABLE))
+
+    def _rows(self, offers_by_op):
+        for op, offers in offers_by_op:
+            for offer_dict in offers:
+                data = {key: to_json_value(value) for key, value in offer_dict.items() if key not in self.field_names}
+                changed_core, changed_data = self._changed_fields(offer_dict)
+                if changed_data is not None:
+                    data = {key: value for key, value in data.items() if key in changed_data}
+
+                yield [op] + [self._to_csv(offer_dict.get(field.name)) for field in self.core_fields] + [
+                    json.dumps(data),
+                    self._to_json(changed_core),
+                    self._to_json(changed_data),
+                    get_fingerprint(offer_dict),
+                ]
+
+    def _changed_fields(self, offer_dict):
+        """
+        :return: tuple (changed core fields, changed keys of data), both are None if all fields have to be written
+        """
+        changed_fields = getattr(offer_dict, 'changed_fields', None)
+        if changed_fields is None:
+            return None, None
+
+        return (
+            [field.name for field in self.core_fields if field.name in changed_fields],
+            [key for key in changed_fields if key not in self.field_names],
+        )
+
+    @staticmethod
+    def _to_json(value):
+        return value if value is None else json.dumps(value)
+
+    @staticmethod
+    def _to_csv(value):
+        return value if value is None else str(value)
+
+    def _insert(self, cursor):
+        cursor.execute(
+            'INSERT INTO {table} '
+            '(store_id, {columns}, data, is_active, deactivated_at, fingerprint, fingerprint_version) '
+            'SELECT %s, {values}, s.data, TRUE, NULL, s.fingerprint, %s FROM {staging} s WHERE s.op = %s '
+            'ON CONFLICT (store_id, external_id) DO UPDATE SET {updates}, data = EXCLUDED.data, '
+            'is_active = TRUE, deactivated_at = NULL, '
+            'fingerprint = EXCLUDED.fingerprint, fingerprint_version = EXCLUDED.fingerprint_version'.format(
+                table=self.table,
+                columns=self._columns(),
+                values=self._values(),
+                staging=self.STAGING_TABLE,
+                updates=', '.join(
+                    '{0} = EXCLUDED.{0}'.format(self._quote(field.column)) for field in self.core_fields
+                ),
+            ),
+            [self.store.id] + self._defaults() + [self.store.data_source.version_hash, self.ADDED]
+        )
+        return cursor.rowcount
+
+    def _deactivate(self, cursor):
+        cursor.execute(
+            'UPDATE {table} o SET is_active = FALSE, deactivated_at = %s FROM {staging} s '
+            'WHERE s.op = %s AND o.store_id = %s AND o.is_active AND o.external_id = s.external_id'.format(
+                table=self.table, staging=self.STAGING_TABLE
+            ),
+            [datetime.now(), self.DELETED, self.store.id]
+        )
+        return cursor.rowcount
+
+    def _update(self, cursor):
+        """
+        Only changed columns get new values and changed keys of data are patched
+        in place, data of offers without changed keys is left untouched.
+        """
+        values = ', '.join(
+            'CASE WHEN s.changed_core IS NULL OR s.changed_core ? %s THEN COALESCE(s.{0}, %s) ELSE o.{0} END'.format(
+                self._quote(field.column)
+            )
+            for field in self.core_fields
+        )
+        data = (
+            'CASE WHEN s.changed_data IS NULL AND o.data = s.data THEN o.data '
+            'WHEN s.changed_data IS NULL THEN s.data '
+            'WHEN jsonb_array_length(s.changed_data) = 0 THEN o.data '
+            'ELSE (o.data - ARRAY(SELECT jsonb_array_elements_text(s.changed_data))) || s.data END'
+        )
+        params = [param for field in self.core_fields for param in (field.name, field.get_default())]
+
+        cursor.execute(
+            'UPDATE {table} o SET ({columns}, data, fingerprint, fingerprint_version) = '
+            '({values}, {data}, s.fingerprint, %s) FROM {staging} s '
+            'WHERE s.op = %s AND o.store_id = %s AND o.is_active AND o.external_id = s.external_id'.format(
+                table=self.table, columns=self._columns(), values=values, data=data, staging=self.STAGING_TABLE
+            ),
+            params + [self.store.data_source.version_hash, self.MODIFIED, self.store.id]
+        )
+        return cursor.rowcount
+
+    def _columns(self):
+        return ', '.join(self._quote(field.column) for field in self.core_fields)
+
+    def _values(self):
+        """
+        Missing values are replaced with defaults, the same way as during saving of Offer model
+        """
+        return ', '.join('COALESCE(s.{}, %s)'.format(self._quote(field.column)) for field in self.core_fields)
+
+    def _defaults(self):
+        return [field.get_default() for field in self.core_fields]
+
+    @staticmethod
+    def _quote(name):
+        return connection.ops.quote_name(name)
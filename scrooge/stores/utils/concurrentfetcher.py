@@ -0,0 +1,69 @@
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from django.db import connection
+
+
+class ConcurrentFetcher:
+    """
+    Fetches data of many stores at the same time. Number of fetches running
+    at once is limited in total and per host of data source, so one slow
+    server does not delay other stores and is not flooded with requests.
+
+    Every fetch still streams data into DataStorageManager of its store,
+    blocking I/O is done in threads driven by asyncio event loop.
+    """
+
+    def __init__(self, concurrency, per_host_concurrency):
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+
+    def fetch(self, stores):
+        """
+        :param stores: list of stores, which data should be fetched
+        :return: list of (store, exception) tuples in order of stores,
+                 exception is None if data of store was fetched successfully
+        """
+        # urls are resolved here, because database can not be queried from event loop
+        hosts = [self._get_host(store) for store in stores]
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self._fetch_all(stores, hosts))
+        finally:
+            loop.close()
+
+    async def _fetch_all(self, stores, hosts):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        host_semaphores = defaultdict(lambda: asyncio.Semaphore(self.per_host_concurrency))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return await asyncio.gather(*[
+                self._fetch_store(store, executor, semaphore, host_semaphores[host])
+                for store, host in zip(stores, hosts)
+            ])
+
+    async def _fetch_store(self, store, executor, semaphore, host_semaphore):
+        async with host_semaphore, semaphore:
+            try:
+                await asyncio.get_event_loop().run_in_executor(executor, self._fetch_in_thread, store)
+            except Exception as e:
+                return store, e
+
+        return store, None
+
+    @staticmethod
+    def _fetch_in_thread(store):
+        try:
+            store.fetch()
+        finally:
+            connection.close()  # every thread has its own connection to database
+
+    @staticmethod
+    def _get_host(store):
+        try:
+            return urlparse(store.data_source.child.url).netloc
+        except Exception:
+            return None  # fetch of the store will fail and report the problem
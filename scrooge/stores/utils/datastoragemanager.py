@@ -1,106 +1,264 @@
-import os
+import hashlib
+import logging
 
 from contextlib import contextmanager
 from datetime import datetime
-from git import Repo
-from git.exc import GitCommandError
+from shutil import copyfileobj
 
 from django.conf import settings
+from django.db import transaction
+
+from scrooge.stores.utils.revisioncache import RevisionCache
+from scrooge.stores.utils.snapshotstorage import SnapshotStorage
+from scrooge.stores.utils.storagebackends import STORAGE_BACKENDS, NoFile, NoRevision
+
+logger = logging.getLogger(__name__)
+
+
+class ContentWriter:
+    """
+    File-like object, which writes data to file and calculates size
+    and hash of written content on the fly.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    @property
+    def content_hash(self):
+        return self._hash.hexdigest()
 
 
 class DataStorageManager:
+    """
+    Saves fetched data of store as numbered revisions. Revisions are catalogued with FeedRevision
+    model, their content is kept by storage backend (ST_STORAGE_BACKEND) of revision.
+    """
     FIRST_REV_NUMBER = 0
-    __revision_tag_name = 'rev-{}'
+    COPY_CHUNK_SIZE = 1024 * 1024
 
-    class NoRevision(Exception):
-        pass
-
-    class NoFile(Exception):
-        pass
+    NoRevision = NoRevision
+    NoFile = NoFile
 
     def __init__(self, store_name):
         self.store_name = store_name
-        self.store_storage_dir = os.path.join(settings.ST_STORES_DATA_DIR, store_name)
+        self.__backends = {}
+        self.backend = self.backend_for(settings.ST_STORAGE_BACKEND)
+        self.cache = RevisionCache()
 
-        os.makedirs(self.store_storage_dir, exist_ok=True)
+        if not self.revisions.exists():
+            self.__import_revisions()
 
-        if not os.path.exists(os.path.join(self.store_storage_dir, '.git/')):
-            self.repo = Repo.init(self.store_storage_dir)
-        else:
-            self.repo = Repo(self.store_storage_dir)
-            self.__asert_is_clean()
+            if not self.revisions.exists():
+                # numbers of revisions start from the beginning, so old snapshots would not match them
+                SnapshotStorage(store_name).clear()
 
-    @contextmanager
-    def save(self, filename):
-        self.__asert_is_clean()
-        file_path = os.path.join(self.store_storage_dir, filename)
+    def backend_for(self, name):
+        if name not in self.__backends:
+            self.__backends[name] = STORAGE_BACKENDS[name](self.store_name)
 
-        file = open(file_path, 'wb')
-        yield file
+        return self.__backends[name]
 
-        file.close()
+    @property
+    def revisions(self):
+        from scrooge.stores.models import FeedRevision  # avoids circular import with stores.models
 
-        date = datetime.now()
+        return FeedRevision.objects.filter(store_name=self.store_name)
 
+    @contextmanager
+    def save(self, filename):
+        """
+        Yields file-like object, content written to it is saved as new revision of filename.
+        If exception is raised inside of with block, nothing is saved and file
+        is restored to its last saved content.
+        """
+        pending = self.backend.begin(filename)
+        writer = ContentWriter(pending)
         try:
-            commits_counter = len(self.repo.git.log())
-        except GitCommandError:
-            commits_counter = 0
+            yield writer
+        except BaseException:
+            pending.abort()
+            raise
 
-        if self.repo.is_dirty() or commits_counter == 0:
-            self.repo.index.add([file_path])
-            commit_datetime_str = date.strftime("%Y-%m-%d %H:%M:%S")
-            commit_msg = "Store: {}\nDate: {}".format(self.store_name, commit_datetime_str)
-            self.repo.index.commit(commit_msg)
+        last_revision = self.revisions.order_by('-number').first()
+        if (
+            last_revision is not None and
+            last_revision.filename == filename and
+            last_revision.content_hash == writer.content_hash
+        ):
+            pending.discard()
+            logger.info('[Store:{}] Content of {} has not changed, new revision is not created'.format(
+                self.store_name, filename
+            ))
+            return
+
+        date = datetime.now()
+        number = last_revision.number + 1 if last_revision is not None else self.FIRST_REV_NUMBER
 
-        self.__increment_revision()
-        self.repo.create_tag("date-{}".format(date.strftime("%Y-%m-%d_%H-%M-%S-%f")))
+        self.revisions.create(
+            store_name=self.store_name,
+            number=number,
+            filename=filename,
+            backend=self.backend.name,
+            storage_key=pending.commit(number, date, writer.content_hash),
+            size=writer.size,
+            content_hash=writer.content_hash,
+            fetched_at=date,
+        )
 
     def get(self, filename, revision=None):
         """
-        Returns content of files saved in DataStorageManager
+        Returns content of files saved in DataStorageManager.
         :param filename: name of file, which content should be returned
         :param revision: if not provided, last revision will be used, otherwise specified revision
         :return: content of the specified filename
         """
-        self.__asert_is_clean()
+        return self.open(filename, revision).read().decode('utf-8')
 
+    def open(self, filename, revision=None):
+        """
+        Returns binary file-like object, which streams content of file from storage
+        as it is read, so content does not have to be copied or decoded before parsing.
+        Content of revisions from remote storage is read through node-local RevisionCache.
+        It has to be read before next file is opened.
+        :param filename: name of file, which content should be returned
+        :param revision: if not provided, last revision will be used, otherwise specified revision
+        """
+        revision = self.revision(revision if revision is not None else self.last_revision_number())
+        backend = self.backend_for(revision.backend)
+
+        if backend.remote:
+            return self.cache.open(revision, filename, lambda: backend.open(revision, filename))
+
+        return backend.open(revision, filename)
+
+    def exists(self, revision=None):
+        """
+        Catalog of revisions is kept in database, so it can outlive content of revisions,
+        e.g. if storage directory or bucket was wiped.
+        :param revision: if not provided, last revision will be checked, otherwise specified revision
+        :return: True if content of revision can still be read from its storage
+        """
         try:
-            revision = revision if revision is not None else self.last_revision_number()
-            self.repo.git.checkout(self.__revision_tag_name.format(revision))
-        except (GitCommandError, DataStorageManager.NoRevision):
-            raise DataStorageManager.NoRevision()
+            revision = self.revision(revision if revision is not None else self.last_revision_number())
+        except DataStorageManager.NoRevision:
+            return False
+
+        return self.backend_for(revision.backend).exists(revision)
+
+    def migrate(self, backend_name):
+        """
+        Copies revisions kept by other storage backends to given backend, numbers
+        and dates of revisions do not change. Content of revisions is not removed
+        from previous backends.
+        :return: number of migrated revisions
+        """
+        backend = self.backend_for(backend_name)
+        migrated = 0
+
+        for revision in self.revisions.exclude(backend=backend_name).order_by('number'):
+            if not revision.filename:
+                logger.warning('[Store:{}] Name of file of revision {} is unknown, it is not migrated'.format(
+                    self.store_name, revision.number
+                ))
+                continue
+
+            source = self.backend_for(revision.backend).open(revision, revision.filename)
+            pending = backend.begin(revision.filename)
+            writer = ContentWriter(pending)
+            try:
+                copyfileobj(source, writer, self.COPY_CHUNK_SIZE)
+            except BaseException:
+                pending.abort()
+                raise
+
+            revision.storage_key = pending.commit(revision.number, revision.fetched_at, writer.content_hash)
+            revision.backend = backend_name
+            revision.size = writer.size
+            revision.content_hash = writer.content_hash
+            revision.save(update_fields=['storage_key', 'backend', 'size', 'content_hash'])
+            migrated += 1
+
+        logger.info('[Store:{}] {} revisions migrated to {} storage'.format(self.store_name, migrated, backend_name))
+        return migrated
+
+    def compact(self, keep_numbers):
+        """
+        Removes revisions, which are not kept (the last revision is always kept), and
+        their content. Numbers of kept revisions do not change.
+        :param keep_numbers: numbers of revisions, which have to be kept
+        :return: list of numbers of removed revisions
+        """
+        revisions = list(self.revisions.order_by('number'))
+        if not revisions:
+            return []
 
-        file_path = os.path.join(self.store_storage_dir, filename)
+        keep_numbers = set(keep_numbers) | {revisions[-1].number}
+        removed = [revision.number for revision in revisions if revision.number not in keep_numbers]
+        if not removed:
+            return []
 
-        if not os.path.exists(file_path):
-            raise DataStorageManager.NoFile()
+        backend_names = {revision.backend for revision in revisions}
+        storage_keys = {}
+        for backend_name in backend_names:
+            storage_keys.update(self.backend_for(backend_name).rewrite([
+                revision for revision in revisions
+                if revision.backend == backend_name and revision.number in keep_numbers
+            ]))
 
-        with open(file_path) as f:
-            content = f.read()
+        with transaction.atomic():
+            for number, storage_key in storage_keys.items():
+                self.revisions.filter(number=number).update(storage_key=storage_key)
+            self.revisions.filter(number__in=removed).delete()
 
-        self.repo.git.checkout('master')
-        return content
+        # content of removed revisions is removed only when catalog does not point at it anymore
+        for backend_name in backend_names:
+            self.backend_for(backend_name).prune(list(self.revisions.filter(backend=backend_name).order_by('number')))
 
-    def __asert_is_clean(self):
-        assert not self.repo.is_dirty(), "Repository '{}' is dirty. " \
-            "Has to be cleaned up before further work.".format(self.store_storage_dir)
+        logger.info('[Store:{}] {} revisions removed, {} kept'.format(
+            self.store_name, len(removed), len(revisions) - len(removed)
+        ))
+        return removed
 
-    def __increment_revision(self):
+    def __import_revisions(self):
+        """
+        Fills catalog of revisions with revisions found in storage,
+        e.g. saved as rev-N tags, before the catalog was introduced
+        """
+        self.revisions.bulk_create([
+            self.revisions.model(store_name=self.store_name, backend=self.backend.name, **fields)
+            for fields in self.backend.stored_revisions()
+        ])
+
+    def revision(self, number):
+        """
+        Returns FeedRevision with given number
+        """
         try:
-            next_rev = self.last_revision_number() + 1
-        except DataStorageManager.NoRevision:
-            next_rev = 0
+            return self.revisions.get(number=number)
+        except self.revisions.model.DoesNotExist:
+            raise DataStorageManager.NoRevision()
 
-        self.repo.create_tag(self.__revision_tag_name.format(next_rev))
+    def revision_at(self, date):
+        """
+        Returns last FeedRevision fetched not later than given date
+        """
+        revision = self.revisions.filter(fetched_at__lte=date).order_by('-fetched_at').first()
+        if revision is None:
+            raise DataStorageManager.NoRevision()
+
+        return revision
 
     def last_revision_number(self):
-        self.__asert_is_clean()
-        try:
-            return max([
-                int(tag.name.replace(self.__revision_tag_name.format(''), ''))
-                for tag in self.repo.tags
-                if tag.name.startswith(self.__revision_tag_name.format(''))
-            ])
-        except ValueError:
+        number = self.revisions.order_by('-number').values_list('number', flat=True).first()
+        if number is None:
             raise DataStorageManager.NoRevision()
+
+        return number
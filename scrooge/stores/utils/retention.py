@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+
+def select_revisions_to_keep(revisions, now, keep_all_days, keep_daily_days, keep_weekly_days=None):
+    """
+    Selects revisions kept by retention policy: all revisions fetched during last keep_all_days days,
+    then the last revision of every day up to keep_daily_days days back and then the last revision
+    of every week up to keep_weekly_days days back (forever, if it is None). Older revisions are
+    dropped, except the last revision, which is always kept.
+    :param revisions: iterable of FeedRevision
+    :return: set of numbers of revisions to keep
+    """
+    keep = set()
+    last_of_period = {}
+
+    revisions = sorted(revisions, key=lambda revision: (revision.fetched_at, revision.number))
+    for revision in revisions:
+        age = now - revision.fetched_at
+
+        if age <= timedelta(days=keep_all_days):
+            keep.add(revision.number)
+        elif age <= timedelta(days=keep_daily_days):
+            last_of_period[revision.fetched_at.date()] = revision.number
+        elif keep_weekly_days is None or age <= timedelta(days=keep_weekly_days):
+            last_of_period[revision.fetched_at.isocalendar()[:2]] = revision.number
+
+    keep.update(last_of_period.values())
+    if revisions:
+        keep.add(revisions[-1].number)
+
+    return keep
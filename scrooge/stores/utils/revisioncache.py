@@ -0,0 +1,125 @@
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from scrooge.stores.utils.snapshotstorage import evict_least_recently_used
+from scrooge.stores.utils.storagebackends import NoFile
+
+logger = logging.getLogger(__name__)
+
+
+class RevisionCache:
+    """
+    Keeps content of revisions read from remote storage on local disk, so revisions
+    used by recent updates are not downloaded again. Files are named after hash of
+    content recorded in catalog of revisions and are checked against it, before they
+    are used. Worker processes downloading the same revision wait for each other.
+
+    Files not used for the longest time are removed when cache takes more than
+    ST_REVISION_CACHE_MAX_SIZE bytes, 0 disables cache.
+    """
+    CACHE_DIR = '.cache'
+    CHUNK_SIZE = 1024 * 1024
+
+    class InvalidContent(Exception):
+        pass
+
+    def __init__(self):
+        root_dir = os.path.join(settings.ST_STORES_DATA_DIR, self.CACHE_DIR)
+        self.files_dir = os.path.join(root_dir, 'revisions')
+        self.temp_dir = os.path.join(root_dir, 'tmp')
+        self.locks_dir = os.path.join(root_dir, 'locks')
+
+    @property
+    def enabled(self):
+        return settings.ST_REVISION_CACHE_MAX_SIZE > 0
+
+    def open(self, revision, filename, fetch):
+        """
+        :param fetch: function, which opens content of revision in storage (binary file-like object)
+        :return: binary file-like object with content of revision
+        :raise InvalidContent: if content fetched from storage does not match hash of revision
+        """
+        if not self.enabled or not revision.content_hash:
+            return fetch()
+
+        if revision.filename and revision.filename != filename:
+            raise NoFile()
+
+        path = os.path.join(self.files_dir, revision.content_hash)
+        with self.__lock(revision.content_hash):
+            if not self.__is_valid(path, revision.content_hash):
+                self.__download(path, revision.content_hash, fetch)
+
+            os.utime(path)  # marks file as recently used
+            cached_file = open(path, 'rb')
+
+        # opened file can be still read, even if it is evicted
+        evict_least_recently_used(self.files_dir, settings.ST_REVISION_CACHE_MAX_SIZE)
+        return cached_file
+
+    @contextmanager
+    def __lock(self, content_hash):
+        os.makedirs(self.locks_dir, exist_ok=True)
+        with open(os.path.join(self.locks_dir, '{}.lock'.format(content_hash)), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __is_valid(self, path, content_hash):
+        try:
+            with open(path, 'rb') as cached_file:
+                content_hash_of_file = self.__copy(cached_file, None)
+        except FileNotFoundError:
+            return False
+
+        if content_hash_of_file != content_hash:
+            logger.warning('Cached revision {} is broken, it will be downloaded again'.format(path))
+            os.remove(path)
+            return False
+
+        return True
+
+    def __download(self, path, content_hash, fetch):
+        os.makedirs(self.files_dir, exist_ok=True)
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(dir=self.temp_dir, delete=False) as temp_file:
+            try:
+                downloaded_content_hash = self.__copy(fetch(), temp_file)
+            except BaseException:
+                os.remove(temp_file.name)
+                raise
+
+        if downloaded_content_hash != content_hash:
+            os.remove(temp_file.name)
+            raise RevisionCache.InvalidContent(
+                'Hash of downloaded content {} does not match hash of revision {}'.format(
+                    downloaded_content_hash, content_hash
+                )
+            )
+
+        os.replace(temp_file.name, path)  # readers never see partially downloaded file
+
+    def __copy(self, source, destination):
+        """
+        :return: hash of copied content
+        """
+        content_hash = hashlib.sha256()
+        while True:
+            chunk = source.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+
+            content_hash.update(chunk)
+            if destination is not None:
+                destination.write(chunk)
+
+        return content_hash.hexdigest()
@@ -0,0 +1,109 @@
+import logging
+import os
+import shutil
+from decimal import Decimal
+
+import msgpack
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DECIMAL_EXT_TYPE = 1
+
+
+def evict_least_recently_used(directory, max_size):
+    """
+    Removes least recently used files from directory (and its subdirectories),
+    until total size of files is not bigger than max_size.
+    """
+    files = []
+    for dir_path, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total_size <= max_size:
+            break
+
+        os.remove(path)
+        total_size -= size
+        logger.info('{} was evicted'.format(path))
+
+
+class SnapshotStorage:
+    """
+    Keeps offers extracted from revisions of data of store as msgpack files, so
+    revision does not have to be parsed again, e.g. when next revision is compared
+    with it. Snapshot is valid only for version of data source, which extracted it.
+
+    Files not used for the longest time are removed when snapshots of all stores
+    take more than ST_SNAPSHOTS_MAX_SIZE bytes, 0 disables snapshots.
+    """
+    SNAPSHOTS_DIR = '.snapshots'
+
+    def __init__(self, store_name):
+        self.store_name = store_name
+        self.root_dir = os.path.join(settings.ST_STORES_DATA_DIR, self.SNAPSHOTS_DIR)
+        self.store_dir = os.path.join(self.root_dir, store_name)
+
+    @property
+    def enabled(self):
+        return settings.ST_SNAPSHOTS_MAX_SIZE > 0
+
+    def load(self, revision, version_hash):
+        """
+        :return: list of offer dicts, None if there is no snapshot
+        """
+        if not self.enabled:
+            return None
+
+        path = self.__path(revision, version_hash)
+        try:
+            with open(path, 'rb') as snapshot_file:
+                offers = msgpack.unpackb(snapshot_file.read(), raw=False, ext_hook=self.__decode)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning('[Store:{}] Snapshot {} is broken, it will be removed'.format(self.store_name, path))
+            os.remove(path)
+            return None
+
+        os.utime(path)  # marks snapshot as recently used
+        return offers
+
+    def save(self, revision, version_hash, offers):
+        if not self.enabled:
+            return
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        path = self.__path(revision, version_hash)
+        tmp_path = '{}.tmp'.format(path)
+
+        with open(tmp_path, 'wb') as snapshot_file:
+            snapshot_file.write(msgpack.packb(offers, use_bin_type=True, default=self.__encode))
+
+        os.replace(tmp_path, path)  # readers never see partially written snapshot
+        evict_least_recently_used(self.root_dir, settings.ST_SNAPSHOTS_MAX_SIZE)
+
+    def clear(self):
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+
+    @staticmethod
+    def __encode(value):
+        if isinstance(value, Decimal):
+            return msgpack.ExtType(DECIMAL_EXT_TYPE, str(value).encode('utf-8'))
+
+        raise TypeError('{} can not be saved in snapshot'.format(type(value)))
+
+    @staticmethod
+    def __decode(code, data):
+        if code == DECIMAL_EXT_TYPE:
+            return Decimal(data.decode('utf-8'))
+
+        return msgpack.ExtType(code, data)
+
+    def __path(self, revision, version_hash):
+        return os.path.join(self.store_dir, 'rev-{}-{}.msgpack'.format(revision, version_hash))
@@ -0,0 +1,505 @@
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import zstandard
+from botocore.exceptions import ClientError
+from git import Commit, Repo
+from git.exc import GitCommandError
+from gitdb.exc import BadName
+
+from django.conf import settings
+
+
+class NoRevision(Exception):
+    pass
+
+
+class NoFile(Exception):
+    pass
+
+
+class GitStorageBackend:
+    """
+    Keeps revisions as commits (tagged rev-N) of git repository in data directory
+    of store, storage key of revision is sha of its commit.
+    """
+    name = 'git'
+    remote = False
+    REVISION_TAG_NAME = 'rev-{}'
+
+    def __init__(self, store_name):
+        self.store_name = store_name
+        self.storage_dir = os.path.join(settings.ST_STORES_DATA_DIR, store_name)
+
+        os.makedirs(self.storage_dir, exist_ok=True)
+
+        if not os.path.exists(os.path.join(self.storage_dir, '.git/')):
+            self.repo = Repo.init(self.storage_dir)
+        else:
+            self.repo = Repo(self.storage_dir)
+            self.assert_is_clean()
+
+    def begin(self, filename):
+        """
+        :return: GitWrite, content written to it becomes new revision when it is committed
+        """
+        self.assert_is_clean()
+        return GitWrite(self, filename)
+
+    def open(self, revision, filename):
+        """
+        Content is streamed directly from git object database, so working tree is not
+        touched and different revisions can be read at the same time.
+        """
+        try:
+            commit = self.repo.commit(revision.storage_key)
+        except (BadName, GitCommandError, ValueError):
+            raise NoRevision()
+
+        try:
+            blob = commit.tree / filename
+        except KeyError:
+            raise NoFile()
+
+        return blob.data_stream
+
+    def exists(self, revision):
+        try:
+            self.repo.commit(revision.storage_key)
+        except (BadName, GitCommandError, ValueError):
+            return False
+
+        return True
+
+    def stored_revisions(self):
+        """
+        :return: list of dicts with fields of FeedRevision for revisions saved as rev-N tags
+        """
+        prefix = self.REVISION_TAG_NAME.format('')
+        revisions = []
+        for tag in self.repo.tags:
+            if not tag.name.startswith(prefix):
+                continue
+
+            blobs = tag.commit.tree.blobs
+            revisions.append({
+                'number': int(tag.name[len(prefix):]),
+                'filename': blobs[0].name if len(blobs) == 1 else '',
+                'size': blobs[0].size if len(blobs) == 1 else 0,
+                'storage_key': tag.commit.hexsha,
+                'fetched_at': datetime.fromtimestamp(tag.commit.committed_date),
+            })
+
+        return revisions
+
+    def rewrite(self, revisions):
+        """
+        Builds new history, which consists only of commits of given revisions (in given order).
+        Messages and dates of commits are kept. Refs are not moved until prune is called.
+        :return: dict with new storage keys of revisions by their numbers
+        """
+        storage_keys = {}
+        parent_commits = []
+        for revision in revisions:
+            commit = self.repo.commit(revision.storage_key)
+            new_commit = Commit.create_from_tree(
+                self.repo, commit.tree, commit.message, parent_commits=parent_commits,
+                author=commit.author, committer=commit.committer,
+                author_date=commit.authored_datetime, commit_date=commit.committed_datetime,
+            )
+            storage_keys[revision.number] = new_commit.hexsha
+            parent_commits = [new_commit]
+
+        return storage_keys
+
+    def prune(self, revisions):
+        """
+        Points branch and rev-N tags at commits of given revisions only, packs refs
+        and runs aggressive gc, so objects of all other commits are removed. All other
+        tags (e.g. date-* tags created by earlier versions) are deleted, they would keep
+        old commits reachable.
+        """
+        if revisions and self.repo.head.is_valid():
+            tree = self.repo.head.commit.tree
+            self.repo.head.reference.set_commit(revisions[-1].storage_key)
+            if self.repo.head.commit.tree != tree:
+                self.repo.head.reset(index=True, working_tree=True)
+
+        tag_names = {self.REVISION_TAG_NAME.format(revision.number): revision for revision in revisions}
+        for tag in list(self.repo.tags):
+            if tag.name not in tag_names:
+                self.repo.delete_tag(tag)
+        for tag_name, revision in tag_names.items():
+            self.repo.create_tag(tag_name, ref=revision.storage_key, force=True)
+
+        self.repo.git.reflog('expire', '--expire=now', '--all')
+        self.repo.git.pack_refs('--all')
+        self.repo.git.gc('--aggressive', '--prune=now')
+
+    def assert_is_clean(self):
+        # only index is checked, comparing working tree would hash whole (possibly huge) file
+        assert not self.repo.is_dirty(working_tree=False), "Repository '{}' is dirty. " \
+            "Has to be cleaned up before further work.".format(self.storage_dir)
+
+
+class GitWrite:
+    """
+    Content is written to working tree of repository and committed with rev-N tag
+    """
+
+    def __init__(self, backend, filename):
+        self.repo = backend.repo
+        self.store_name = backend.store_name
+        self.file_path = os.path.join(backend.storage_dir, filename)
+        self.revision_tag_name = backend.REVISION_TAG_NAME
+        self.file = open(self.file_path, 'wb')
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def commit(self, number, date, content_hash):
+        """
+        :return: storage key of new revision
+        """
+        self.file.close()
+
+        self.repo.index.add([self.file_path])
+        commit_datetime_str = date.strftime("%Y-%m-%d %H:%M:%S")
+        commit_msg = "Store: {}\nDate: {}".format(self.store_name, commit_datetime_str)
+        self.repo.index.commit(commit_msg, author_date=date.astimezone(), commit_date=date.astimezone())
+        self.repo.create_tag(self.revision_tag_name.format(number), force=True)
+
+        return self.repo.head.commit.hexsha
+
+    def discard(self):
+        """
+        Content is the same as content of last revision, so file does not have to be restored
+        """
+        self.file.close()
+
+    def abort(self):
+        """
+        Discards partially written file, last committed content is checked out again
+        """
+        self.file.close()
+
+        if (os.path.relpath(self.file_path, self.repo.working_tree_dir), 0) in self.repo.index.entries:
+            self.repo.index.checkout([self.file_path], force=True)
+        else:
+            os.remove(self.file_path)
+
+
+class ZstdStorageBackend:
+    """
+    Keeps every revision as zstd-compressed blob named after hash of its content (so
+    the same content is stored only once), storage key of revision is hash of its content.
+    Small index of revisions (JSON lines) is kept next to blobs, so catalog of revisions
+    can be restored from it.
+    """
+    name = 'zstd'
+    remote = False
+    BLOBS_DIR = '.blobs'
+    INDEX_FILE_NAME = 'revisions.jsonl'
+    COMPRESSION_LEVEL = 9
+
+    def __init__(self, store_name):
+        self.store_name = store_name
+        self.storage_dir = os.path.join(settings.ST_STORES_DATA_DIR, self.BLOBS_DIR, store_name)
+        self.index_path = os.path.join(self.storage_dir, self.INDEX_FILE_NAME)
+
+        os.makedirs(self.storage_dir, exist_ok=True)
+
+    def begin(self, filename):
+        """
+        :return: ZstdWrite, content written to it becomes new revision when it is committed
+        """
+        return ZstdWrite(self, filename)
+
+    def open(self, revision, filename):
+        """
+        Content is decompressed as it is read
+        """
+        if revision.filename and revision.filename != filename:
+            raise NoFile()
+
+        try:
+            blob = open(self.blob_path(revision.storage_key), 'rb')
+        except FileNotFoundError:
+            raise NoRevision()
+
+        return zstandard.ZstdDecompressor().stream_reader(blob)
+
+    def exists(self, revision):
+        return os.path.exists(self.blob_path(revision.storage_key))
+
+    def stored_revisions(self):
+        """
+        :return: list of dicts with fields of FeedRevision for revisions in index
+        """
+        if not os.path.exists(self.index_path):
+            return []
+
+        revisions = []
+        with open(self.index_path) as index:
+            for line in index:
+                entry = json.loads(line)
+                revisions.append(dict(
+                    entry, storage_key=entry['content_hash'], fetched_at=datetime.fromisoformat(entry['fetched_at'])
+                ))
+
+        return revisions
+
+    def rewrite(self, revisions):
+        """
+        Blobs do not depend on each other, so storage keys of kept revisions do not change
+        """
+        return {}
+
+    def prune(self, revisions):
+        """
+        Rewrites index, so it consists only of given revisions,
+        and removes blobs, which are not used by them.
+        """
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as index:
+            for revision in revisions:
+                self.write_index_entry(index, revision.number, revision.filename, revision.content_hash,
+                                       revision.size, revision.fetched_at)
+        os.replace(temp_path, self.index_path)
+
+        used_blobs = {self.blob_path(revision.storage_key) for revision in revisions}
+        for dir_path, _, file_names in os.walk(self.storage_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                if file_name.endswith('.zst') and path not in used_blobs:
+                    os.remove(path)
+
+    def blob_path(self, content_hash):
+        return os.path.join(self.storage_dir, content_hash[:2], '{}.zst'.format(content_hash))
+
+    @staticmethod
+    def write_index_entry(index, number, filename, content_hash, size, fetched_at):
+        index.write(json.dumps({
+            'number': number,
+            'filename': filename,
+            'content_hash': content_hash,
+            'size': size,
+            'fetched_at': fetched_at.isoformat(),
+        }) + '\n')
+
+
+class ZstdWrite:
+    """
+    Content is compressed on the fly into temporary file, which is renamed to blob on commit
+    """
+
+    def __init__(self, backend, filename):
+        self.backend = backend
+        self.filename = filename
+        self.file = tempfile.NamedTemporaryFile(dir=backend.storage_dir, suffix='.tmp', delete=False)
+        self.compressor = zstandard.ZstdCompressor(level=backend.COMPRESSION_LEVEL).stream_writer(self.file)
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return self.compressor.write(data)
+
+    def commit(self, number, date, content_hash):
+        """
+        :return: storage key of new revision
+        """
+        self.compressor.flush(zstandard.FLUSH_FRAME)
+        self.file.close()
+
+        blob_path = self.backend.blob_path(content_hash)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(self.file.name, blob_path)
+
+        with open(self.backend.index_path, 'a') as index:
+            self.backend.write_index_entry(index, number, self.filename, content_hash, self.size, date)
+
+        return content_hash
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.file.name)
+
+    def abort(self):
+        self.discard()
+
+
+class S3StorageBackend:
+    """
+    Keeps every revision as object in S3-compatible object storage (ST_S3_BUCKET, ST_S3_ENDPOINT_URL),
+    so revisions of any store can be read by workers on any node. Storage key of revision is name
+    of its object under ST_S3_PREFIX/<store>/. Catalog of revisions in database is its only index.
+    """
+    name = 's3'
+    remote = True
+    # objects not used by any revision are removed only when they are older, they can be still saved
+    PRUNE_MIN_AGE = timedelta(days=1)
+
+    def __init__(self, store_name):
+        self.store_name = store_name
+        self.bucket = settings.ST_S3_BUCKET
+        self.prefix = '{}{}/'.format(settings.ST_S3_PREFIX, store_name)
+        self.client = boto3.client(
+            's3', endpoint_url=settings.ST_S3_ENDPOINT_URL or None, region_name=settings.ST_S3_REGION_NAME
+        )
+
+    def begin(self, filename):
+        """
+        :return: S3Write, content written to it becomes new revision when it is committed
+        """
+        return S3Write(self, self.object_key(uuid.uuid4().hex))
+
+    def open(self, revision, filename):
+        """
+        Content is read in ranges of ST_S3_READ_CHUNK_SIZE bytes as it is consumed
+        """
+        if revision.filename and revision.filename != filename:
+            raise NoFile()
+
+        key = self.object_key(revision.storage_key)
+        try:
+            size = self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+        except ClientError:
+            raise NoRevision()
+
+        return io.BufferedReader(S3RangeReader(self.client, self.bucket, key, size), settings.ST_S3_READ_CHUNK_SIZE)
+
+    def exists(self, revision):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(revision.storage_key))
+        except ClientError:
+            return False
+
+        return True
+
+    def stored_revisions(self):
+        return []
+
+    def rewrite(self, revisions):
+        """
+        Objects do not depend on each other, so storage keys of kept revisions do not change
+        """
+        return {}
+
+    def prune(self, revisions):
+        """
+        Removes objects of store, which are not used by given revisions
+        """
+        used_keys = {self.object_key(revision.storage_key) for revision in revisions}
+        max_last_modified = datetime.now(timezone.utc) - self.PRUNE_MIN_AGE
+
+        pages = self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=self.prefix)
+        for page in pages:
+            for stored_object in page.get('Contents', []):
+                if stored_object['Key'] not in used_keys and stored_object['LastModified'] < max_last_modified:
+                    self.client.delete_object(Bucket=self.bucket, Key=stored_object['Key'])
+
+    def object_key(self, storage_key):
+        return self.prefix + storage_key
+
+
+class S3Write:
+    """
+    Content is uploaded in parts of ST_S3_PART_SIZE bytes while it is written (multipart
+    upload is started only if content is bigger), object is completed on commit.
+    """
+
+    def __init__(self, backend, key):
+        self.client = backend.client
+        self.bucket = backend.bucket
+        self.key = key
+        self.storage_key = key[len(backend.prefix):]
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= settings.ST_S3_PART_SIZE:
+            self.__upload_part()
+
+        return len(data)
+
+    def commit(self, number, date, content_hash):
+        """
+        :return: storage key of new revision
+        """
+        if self.upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+        else:
+            if self.buffer:
+                self.__upload_part()
+
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': self.parts}
+            )
+
+        return self.storage_key
+
+    def discard(self):
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+    def abort(self):
+        self.discard()
+
+    def __upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=bytes(self.buffer)
+        )
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+        self.buffer = bytearray()
+
+
+class S3RangeReader(io.RawIOBase):
+    """
+    Reads object with separate ranged requests, every read fetches only requested part of object
+    """
+
+    def __init__(self, client, bucket, key, size):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.__read_range(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readall(self):
+        return self.__read_range(self.size - self.position)
+
+    def __read_range(self, length):
+        length = min(length, self.size - self.position)
+        if length <= 0:
+            return b''
+
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self.key, Range='bytes={}-{}'.format(self.position, self.position + length - 1)
+        )
+        data = response['Body'].read()
+        self.position += len(data)
+        return data
+
+
+STORAGE_BACKENDS = {
+    backend.name: backend for backend in [GitStorageBackend, ZstdStorageBackend, S3StorageBackend]
+}
@@ -0,0 +1,104 @@
+import fcntl
+import logging
+import os
+import uuid
+from threading import Event, Thread
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class StoreLocked(Exception):
+    pass
+
+
+class FileStoreLock:
+    """
+    Lock of store shared by processes of this node. It is kept with flock,
+    so it is released by system, if process holding it dies.
+    """
+    LOCKS_DIR = '.locks'
+
+    def __init__(self, store_name):
+        self.store_name = store_name
+        self.path = os.path.join(settings.ST_STORES_DATA_DIR, self.LOCKS_DIR, '{}.lock'.format(store_name))
+        self.lock_file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock_file = open(self.path, 'w')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            raise StoreLocked('[Store:{}] Store is locked by other process'.format(self.store_name))
+
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+
+
+class RedisStoreLock:
+    """
+    Lock of store shared by all nodes, which use the same Redis (ST_STORE_LOCK_REDIS_URL).
+    Lock is a key with lease of ST_STORE_LOCK_LEASE seconds, which is renewed in background
+    while lock is held, so lock of node, which died, expires soon.
+    """
+    KEY = 'scrooge:store-lock:{}'
+    # key is changed only by owner of lock, who is identified by random token
+    RENEW_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) " \
+                   "else return 0 end"
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, store_name, client=None):
+        self.store_name = store_name
+        self.client = client or redis.Redis.from_url(settings.ST_STORE_LOCK_REDIS_URL)
+        self.key = self.KEY.format(store_name)
+        self.token = uuid.uuid4().hex
+        self.lease = settings.ST_STORE_LOCK_LEASE
+        self.lease_ms = int(self.lease * 1000)
+        self.released = Event()
+        self.renewal = None
+
+    def __enter__(self):
+        if not self.client.set(self.key, self.token, nx=True, px=self.lease_ms):
+            raise StoreLocked('[Store:{}] Store is locked by other worker'.format(self.store_name))
+
+        self.renewal = Thread(target=self.__renew, daemon=True)
+        self.renewal.start()
+        return self
+
+    def __exit__(self, *args):
+        self.released.set()
+        self.renewal.join()
+        self.client.eval(self.RELEASE_SCRIPT, 1, self.key, self.token)
+
+    def __renew(self):
+        while not self.released.wait(self.lease / 3):
+            try:
+                renewed = self.client.eval(self.RENEW_SCRIPT, 1, self.key, self.token, self.lease_ms)
+            except redis.RedisError as e:
+                logger.warning('[Store:{}] Lock of store could not be renewed: {}'.format(self.store_name, e))
+                continue
+
+            if not renewed:
+                logger.error('[Store:{}] Lock of store has expired before it was renewed'.format(self.store_name))
+                return
+
+
+STORE_LOCKS = {
+    'file': FileStoreLock,
+    'redis': RedisStoreLock,
+}
+
+
+def store_lock(store_name):
+    """
+    :return: lock of store (context manager) of type chosen with ST_STORE_LOCK_BACKEND,
+             StoreLocked is raised on enter, if store is already locked
+    """
+    return STORE_LOCKS[settings.ST_STORE_LOCK_BACKEND](store_name)